@@ -0,0 +1,62 @@
+"""benchmark the colorized formatting of table cells (utils.cprint)
+
+Usage:
+  bench_cprint.py [--rows=N] [--columns=N]
+
+Options:
+    --rows=N        rows of the synthetic table [default: 200000]
+    --columns=N     columns of the synthetic table [default: 6]
+
+Every cell is formatted with the style of its column: the style lookup per cell
+(as cformat did before the style cache), cformat per cell and cformat_many per column,
+the three outputs must be identical. Run it from the repository root: python -m benchmarks.bench_cprint
+"""
+import time
+from itertools import cycle
+from typing import Any
+
+from docopt import docopt
+
+from utils.cprint import bg_color_map, cformat, cformat_many, fg_color_map, fix_color_name, style_map
+
+COLORS = ["cyan", "yellow", "magenta", "white", "lightred", "lightgreen", "lightblue"]
+
+
+def uncached_cformat(value: Any, fg_color: str = '', bg_color: str = '', style: str = '') -> str:
+    """the color names resolved on every call (the baseline)"""
+    fg = fg_color_map.get(fix_color_name(fg_color), "")
+    bg = bg_color_map.get(fix_color_name(bg_color), "")
+    st = style_map.get(style.upper(), "")
+    return bg + fg + st + str(value)
+
+
+def main(**kwargs):
+    args = docopt(doc=__doc__, **kwargs)
+    n_rows, n_columns = int(args["--rows"]), int(args["--columns"])
+    columns = [[k * j for k in range(n_rows)] for j in range(n_columns)]
+    colors = [color for color, _ in zip(cycle(COLORS), columns)]
+    cells = n_rows * n_columns
+
+    def per_cell(fn):
+        return [[fn(x, fg_color=color, style="NORMAL") for x in column] for color, column in zip(colors, columns)]
+
+    methods = {
+        "uncached lookup": lambda: per_cell(uncached_cformat),
+        "cformat": lambda: per_cell(cformat),
+        "cformat_many": lambda: [cformat_many(column, fg_color=color, style="NORMAL")
+                                 for color, column in zip(colors, columns)],
+    }
+
+    expected = None
+    print(f"{'method':<16} {'seconds':>10} {'Mcells/s':>10}")
+    for name, method in methods.items():
+        t0 = time.perf_counter()
+        result = method()
+        dt = time.perf_counter() - t0
+        expected = result if expected is None else expected
+        assert result == expected, f"{name} output differs"
+        print(f"{name:<16} {dt:>10.3f} {cells / dt / 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""benchmark the decompression layer of the file tools (utils.compression)
+
+Usage:
+  bench_decompress.py [--size=MB] [--threads=LIST]
+
+Options:
+    --size=MB           size of the synthetic (decompressed) data in MB [default: 256]
+    --threads=LIST      comma separated values of the threads to be measured [default: 1,2,4,8,16]
+
+The overall and the per core throughput (decompressed MB/s) is reported for every codec,
+run it from the repository root: python -m benchmarks.bench_decompress
+"""
+import gzip
+import io
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+from docopt import docopt
+
+from utils.compression import open_decompressed, wrap_range_reader, zstandard
+from utils.rangeio import RangeStream, open_raw_range_reader
+
+BGZF_BLOCK_SIZE = 65280
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+ZSTD_FRAME_SIZE = 1024 * 1024
+
+
+def make_data(size_mb: int) -> bytes:
+    """a synthetic jsonl file of roughly `size_mb` MB"""
+    lines = [f'{{"id": {k}, "name": "user-{k % 977}", "score": {k * 7 % 1000 / 10}}}' for k in range(10000)]
+    block = ("\n".join(lines) + "\n").encode("utf8")
+    return block * max(1, size_mb * 1024 * 1024 // len(block))
+
+
+def write_bgzf(data: bytes, path: str):
+    """bgzip: independent gzip members of 64 KiB with the block size in the `BC` extra field"""
+    with open(path, "wb") as fp:
+        for k in range(0, len(data), BGZF_BLOCK_SIZE):
+            chunk = data[k:k + BGZF_BLOCK_SIZE]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = compressor.compress(chunk) + compressor.flush()
+            header = b"\x1f\x8b\x08\x04" + struct.pack("<IBBH", 0, 0, 255, 6) + b"BC"
+            header += struct.pack("<HH", 2, 18 + len(deflated) + 8 - 1)
+            fp.write(header + deflated + struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+        fp.write(BGZF_EOF)
+
+
+def write_seekable_zstd(data: bytes, path: str):
+    """zstd seekable format: independent frames and a seek table at the end"""
+    compressor = zstandard.ZstdCompressor()
+    entries = []
+    with open(path, "wb") as fp:
+        for k in range(0, len(data), ZSTD_FRAME_SIZE):
+            frame = compressor.compress(data[k:k + ZSTD_FRAME_SIZE])
+            fp.write(frame)
+            entries.append(struct.pack("<II", len(frame), len(data[k:k + ZSTD_FRAME_SIZE])))
+        table = b"".join(entries) + struct.pack("<IBI", len(entries), 0, 0x8F92EAB1)
+        fp.write(struct.pack("<II", 0x184D2A5E, len(table)) + table)
+
+
+def measure(open_fn, size: int) -> float:
+    """decompressed MB/s reading the whole stream"""
+    t0 = time.perf_counter()
+    with open_fn() as fp:
+        total = sum(len(x) for x in iter(lambda: fp.read(8 * 1024 * 1024), b""))
+    dt = time.perf_counter() - t0
+    assert total == size
+    return size / 1024 / 1024 / dt
+
+
+def main(**kwargs):
+    args = docopt(doc=__doc__, **kwargs)
+    data = make_data(int(args["--size"]))
+    threads_list = [int(x) for x in args["--threads"].split(",")]
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {"gzip": os.path.join(folder, "data.gz"), "bgzf": os.path.join(folder, "data.bgz")}
+        with open(paths["gzip"], "wb") as fp:
+            fp.write(gzip.compress(data, compresslevel=6))
+        write_bgzf(data, paths["bgzf"])
+        if zstandard is not None:
+            paths["zstd"] = os.path.join(folder, "data.zst")
+            with open(paths["zstd"], "wb") as fp:
+                fp.write(zstandard.ZstdCompressor().compress(data))
+            paths["zstd seekable"] = os.path.join(folder, "data.seekable.zst")
+            write_seekable_zstd(data, paths["zstd seekable"])
+
+        print(f"{'codec':<16} {'threads':>8} {'MB/s':>10} {'MB/s/core':>10}")
+        for codec, path in paths.items():
+            # sequential codecs don't use the threads
+            for threads in threads_list if codec in ("bgzf", "zstd seekable") else [1]:
+                if codec == "zstd seekable":
+                    reader_fn = lambda: wrap_range_reader(open_raw_range_reader(path), threads=threads)
+                    open_fn = lambda: io.BufferedReader(RangeStream(reader_fn()), 8 * 1024 * 1024)
+                else:
+                    open_fn = lambda: open_decompressed(open(path, "rb"), threads=threads)
+                speed = measure(open_fn, len(data))
+                print(f"{codec:<16} {threads:>8} {speed:>10.1f} {speed / threads:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
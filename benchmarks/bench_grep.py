@@ -0,0 +1,67 @@
+"""benchmark the parallel search of pycat --grep (utils.grep)
+
+Usage:
+  bench_grep.py [--size=MB] [--range-size=KB] [--jobs=LIST]
+
+Options:
+    --size=MB           size of the synthetic file in MB [default: 64]
+    --range-size=KB     bytes searched by a task in KB, small values give many range boundaries [default: 1024]
+    --jobs=LIST         comma separated values of the processes to be measured [default: 1,2,4]
+
+The matches of every pattern (the ranges of the file and a stream of it) must be the lines matched
+one by one by `re`, patterns matching the empty string (`^$`, `x|$`) included,
+run it from the repository root: python -m benchmarks.bench_grep
+"""
+import io
+import os
+import re
+import tempfile
+import time
+
+from docopt import docopt
+
+from utils.grep import grep_file
+
+PATTERNS = [rb"ERROR", rb"^0000+1", rb"^$", rb"7$|^$", rb"x|$"]
+
+
+def make_data(size_mb: int) -> bytes:
+    """a synthetic log of roughly `size_mb` MB with some empty lines"""
+    lines = [f"{k:012d} {'ERROR' if k % 101 == 0 else 'INFO'} {'x' * (k % 37)}" if k % 53 else ""
+             for k in range(10000)]
+    block = ("\n".join(lines) + "\n").encode("utf8")
+    return block * max(1, size_mb * 1024 * 1024 // len(block))
+
+
+def expected_lines(data: bytes, pattern: bytes) -> list:
+    """the line numbers of the lines matching the pattern, one line at a time"""
+    regex = re.compile(pattern, re.MULTILINE)
+    return [k + 1 for k, line in enumerate(data.split(b"\n")[:-1]) if regex.search(line)]
+
+
+def main(**kwargs):
+    args = docopt(doc=__doc__, **kwargs)
+    data = make_data(int(args["--size"]))
+    range_size = int(args["--range-size"]) * 1024
+    size_mb = len(data) / 1024 / 1024
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "data.log")
+        with open(path, "wb") as fp:
+            fp.write(data)
+
+        print(f"{'pattern':<10} {'jobs':>6} {'matches':>10} {'seconds':>10} {'MB/s':>10}")
+        for pattern in PATTERNS:
+            expected = expected_lines(data, pattern)
+            for jobs in [int(x) for x in args["--jobs"].split(",")]:
+                t0 = time.perf_counter()
+                lines = [x.line for x in grep_file(path, pattern, jobs=jobs, range_size=range_size)]
+                dt = time.perf_counter() - t0
+                assert lines == expected, f"{pattern!r} with {jobs} jobs: wrong matches"
+                print(f"{pattern.decode():<10} {jobs:>6} {len(lines):>10} {dt:>10.3f} {size_mb / dt:>10.1f}")
+            streamed = [x.line for x in grep_file(path, pattern, jobs=1, fp=io.BytesIO(data), range_size=range_size)]
+            assert streamed == expected, f"{pattern!r} streamed: wrong matches"
+
+
+if __name__ == '__main__':
+    main()
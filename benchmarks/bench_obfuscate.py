@@ -0,0 +1,109 @@
+"""benchmark the obfuscation of a table of strings (utils.obfuscation)
+
+Usage:
+  bench_obfuscate.py [--rows=N] [--legacy-rows=N] [--p-obf=P] [--p-empty-rows=P] [--seed=N]
+
+Options:
+    --rows=N            rows of the synthetic table [default: 1000000]
+    --legacy-rows=N     rows obfuscated by the row by row baseline (it is slow) [default: 20000]
+    --p-obf=P           probability of substituting a character [default: 0.01]
+    --p-empty-rows=P    probability of inserting empty rows after a row [default: 0.2]
+    --seed=N            seed of the random generators [default: 0]
+
+The baseline is the row by row obfuscation csvobf used before (iterrows, Homoglyph.random_sub
+per cell and string concatenation per character), it runs over the first --legacy-rows rows.
+The vectorized engine runs over the whole table twice with the same seed (the outputs must be
+identical) and the rate of substituted characters is compared with p_obf.
+Run it from the repository root: python -m benchmarks.bench_obfuscate
+"""
+import time
+from random import randint, random, seed as random_seed
+
+import numpy as np
+import pandas as pd
+from docopt import docopt
+
+from utils.obfuscation import HOMOGLYPH_COUNTS, Homoglyph, obfuscate
+
+WORDS = ["Alice", "Bob", "Carol", "Dave", "Eve", "Mallory", "Oscar", "Peggy", "Trent", "Victor",
+         "street", "avenue", "road", "north", "south", "plaza", "x-42", "id_007", "3rd floor", "San José"]
+
+
+def legacy_obfuscate(df: pd.DataFrame, col_names_and_flags, p_obf, p_empty) -> pd.DataFrame:
+    """the row by row obfuscation (the baseline)"""
+    only_col_names = [x for x, _ in col_names_and_flags]
+    for k, row in df.iterrows():
+        for col_name, obfuscate_flag in col_names_and_flags:
+            if obfuscate_flag:
+                new_value, changed = Homoglyph.random_sub(row[col_name], probability=p_obf)
+                row[col_name] = new_value
+    for k, row in df.iterrows():
+        for c in only_col_names:
+            new_val = ""
+            for ci in row[c]:
+                if ci == " " and random() < 0.35:
+                    ci = ", " if random() < 0.5 else "; "
+                new_val += ci
+            row[c] = new_val
+    new_id = 0
+    new_rows = []
+    for k, row in df.iterrows():
+        new_id += 1
+        row_dict = {k: v for k, v in row.items()}
+        row_dict["id"] = new_id
+        new_rows.append(row_dict)
+        if random() < p_empty:
+            for _ in range(randint(3, 10)):
+                new_id += 1
+                row_dict = {k: "" for k, v in row.items()}
+                row_dict["id"] = new_id
+                new_rows.append(row_dict)
+    return pd.DataFrame(new_rows)
+
+
+def synthetic_table(n_rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS, dtype=object)
+
+    def column(n_words):
+        parts = [words[rng.integers(0, len(words), n_rows)] for _ in range(n_words)]
+        return [" ".join(x) for x in zip(*parts)]
+
+    return pd.DataFrame({"name": column(2), "address": column(4), "note": column(3)})
+
+
+def main(**kwargs):
+    args = docopt(doc=__doc__, **kwargs)
+    n_rows, legacy_rows = int(args["--rows"]), int(args["--legacy-rows"])
+    p_obf, p_empty, seed = float(args["--p-obf"]), float(args["--p-empty-rows"]), int(args["--seed"])
+    df = synthetic_table(n_rows, seed)
+    flags = [(x, True) for x in df.columns]
+
+    print(f"{'method':<12} {'rows':>10} {'seconds':>10} {'rows/s':>12}")
+    random_seed(seed)
+    legacy_df = df.head(legacy_rows).copy()
+    t0 = time.perf_counter()
+    legacy_obfuscate(legacy_df, flags, p_obf, p_empty)
+    dt = time.perf_counter() - t0
+    print(f"{'legacy':<12} {len(legacy_df):>10} {dt:>10.3f} {len(legacy_df) / dt:>12.0f}")
+
+    results = []
+    for _ in range(2):
+        t0 = time.perf_counter()
+        results.append(obfuscate(df, flags, p_obf, p_empty, rng=np.random.default_rng(seed)))
+        dt = time.perf_counter() - t0
+        print(f"{'vectorized':<12} {n_rows:>10} {dt:>10.3f} {n_rows / dt:>12.0f}")
+    assert results[0].equals(results[1]), "the same seed gave different outputs"
+
+    # the characters with homoglyphs of the input that are not ascii in the output
+    text = "".join(df["name"])
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    candidates = int((HOMOGLYPH_COUNTS[codepoints[codepoints < 128]] > 0).sum())
+    rows = results[0][results[0]["name"] != ""]["name"]
+    substituted = sum(1 for c in "".join(rows) if ord(c) > 127) - sum(1 for c in text if ord(c) > 127)
+    print(f"substituted {substituted / max(1, candidates):.4f} of the characters with homoglyphs (p_obf={p_obf})")
+    print(f"output rows {len(results[0])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""benchmark the streaming tail of pytail for a growing number of lines
+
+Usage:
+  bench_pytail.py [--size=MB] [--lines=LIST]
+
+Options:
+    --size=MB       size of the synthetic stream in MB [default: 64]
+    --lines=LIST    comma separated values of -n to be measured [default: 10,1000,100000,1000000]
+
+The throughput of `pytail.tail` should stay flat when -n grows,
+run it from the repository root: python -m benchmarks.bench_pytail
+"""
+import io
+import time
+
+from docopt import docopt
+
+from pytail import tail
+
+
+def make_stream(size_mb: int) -> bytes:
+    """build a synthetic log of roughly `size_mb` MB with lines of different lengths"""
+    lines = [f"{k:012d} INFO some message of the log line {'x' * (k % 97)}" for k in range(10000)]
+    block = ("\n".join(lines) + "\n").encode("utf8")
+    return block * max(1, size_mb * 1024 * 1024 // len(block))
+
+
+def main(**kwargs):
+    args = docopt(doc=__doc__, **kwargs)
+    data = make_stream(int(args["--size"]))
+    size_mb = len(data) / 1024 / 1024
+
+    print(f"{'-n':>10} {'seconds':>10} {'MB/s':>10}")
+    for n in [int(x) for x in args["--lines"].split(",")]:
+        t0 = time.perf_counter()
+        lines = tail(io.BytesIO(data), n)
+        dt = time.perf_counter() - t0
+        assert len(lines) == min(n, data.count(b"\n"))
+        print(f"{n:>10} {dt:>10.3f} {size_mb / dt:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
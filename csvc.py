@@ -1,32 +1,77 @@
 """CSV processing file
 
 Usage:
-    csvc.py [--filter=LAMBDA] [--columns=COLS] [--exclude-columns=COLS] [--skip-rows=N] [--output=OUT] <FILE>
+    csvc.py [--where=EXPR] [--filter=LAMBDA] [--columns=COLS] [--exclude-columns=COLS] [--skip-rows=N] [--output=OUT]
+            [--chunksize=N] [--dtypes=SPEC] [--engine=ENGINE] [--sort-by=KEYS [--top=K] [--mem-limit=SIZE]] <FILE>
+    csvc.py agg --agg=SPEC [--group-by=COLS] [--where=EXPR] [--filter=LAMBDA] [--skip-rows=N] [--output=OUT]
+            [--chunksize=N] [--dtypes=SPEC] [--engine=ENGINE] [--jobs=N] <FILE>
     csvc.py --list-columns [--skip-rows=N] <FILE>
 
 
 Arguments:
-    <FILE>      The csv file to process
+    <FILE>      The csv file to process (.parquet/.pq and .feather/.arrow files are read as parquet and feather)
 
 Options:
+    -w,--where=EXPR       Filter by a vectorized expression over whole columns (DataFrame.query syntax), e.g.
+                          "amount > 100 and country == 'MX'", use backticks for names with spaces: "`unit price` < 5"
     -f,--filter=LAMBDA    Filter by LAMBDA expression of the form 'lambda x: True' [default: lambda x: True]
+                          (it is called for every row, prefer --where for large files)
     -c,--columns=COLS     Columns to include in the result [default: *]
     -x,--exclude-columns=COLS      Columns to exclude from the result [default: ]
     -s,--skip-rows=N      Skip rows starting from this number [default: 0]
-    -o,--output=OUT       Output file [default: stdout]
-    -l,--list-columns      Only list the column names
+    -o,--output=OUT       Output file, csv or parquet/feather according to the extension [default: stdout]
+    -l,--list-columns      Only list the column names (only the header row is read)
+    -k,--chunksize=N      Stream the file in chunks of N rows: only the needed columns are parsed and every
+                          filtered chunk is written right away, so the memory doesn't grow with the file
+                          (the output is csv, also in stdout)
+    -d,--dtypes=SPEC      Types of some columns as NAME:TYPE pairs (pandas dtypes) separated by commas,
+                          e.g. "id:int64,price:float32,country:category", a parquet/feather output written
+                          in chunks keeps the types of the first chunk: give them when a later chunk differs
+    -e,--engine=ENGINE    CSV parser: c, python or pyarrow (multithreaded, not available with --chunksize) [default: c]
+    -S,--sort-by=KEYS     Sort the rows by these columns, a column can be followed by :desc (or :asc), e.g.
+                          "country,amount:desc", missing values go last and ties keep the order of the file
+                          (the sorted rows are streamed, stdout is csv)
+    -t,--top=K            Only the first K rows of the sorted result (only K rows are kept in memory)
+    -m,--mem-limit=SIZE   Memory used by --sort-by before spilling sorted runs to a temporary directory, they are
+                          merged at the end (an external merge sort), e.g. 512MB, 4G [default: 1G]
+    -a,--agg=SPEC         Aggregations as FUNCTION:COLUMN pairs separated by commas, FUNCTION is one of
+                          sum, count, mean, min, max and count:* counts the rows, e.g. "sum:amount,count:*,mean:price"
+    -g,--group-by=COLS    Columns to group by, without it the whole file is a single group (the keys of csv files
+                          are read as text unless --dtypes gives their type)
+    -j,--jobs=N           Processes used by agg, csv files are split in line aligned byte ranges (they can't have
+                          newlines inside quoted values) and parquet files by row groups [default: 1]
+
+agg reads the file once in chunks (of 1000000 rows without --chunksize) keeping only mergeable partial
+aggregates (sums, counts, minimums and maximums by group), so files larger than the memory can be aggregated.
+
+Only the selected columns (and the ones used by --where) are parsed, the excluded columns are never read.
 """
+import functools
+import io
+import itertools
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
 from docopt import docopt
+import numpy as np
 import pandas as pd
 from colorama import Fore, init
 
+from utils.output import exit_on_broken_pipe
+from utils.rangeio import NotSeekableError, line_start, open_range_reader
+from utils.sizes import parse_size
+from utils.sorting import ExternalSorter, parse_sort_keys
+from utils.tables import TableWriter, file_format, parse_dtypes, read_chunks, read_header
+
 init(autoreset=True)
 
 
-def validate_columns(columns, df) -> bool:
-    """validate the column names against a dataframe"""
-    good_columns = [x for x in columns if x in df.columns]
-    wrong_columns = [x for x in columns if x not in df.columns]
+def validate_columns(columns, header) -> bool:
+    """validate the column names against the header of the csv"""
+    good_columns = [x for x in columns if x in header]
+    wrong_columns = [x for x in columns if x not in header]
     if len(wrong_columns) > 0:
         for k, xk in enumerate(columns):
             flag = xk in good_columns
@@ -44,59 +89,339 @@ def validate_columns(columns, df) -> bool:
     return True
 
 
+# the default --filter, it keeps every row
+NO_FILTER = "lambda x: True"
+
+
+def apply_where(df: pd.DataFrame, expression: str) -> pd.DataFrame:
+    """keep the rows matching the expression, evaluated over whole columns with DataFrame.eval (query syntax)
+
+    :param df: the dataframe to filter
+    :type df: pd.DataFrame
+    :param expression: a boolean expression of the columns like "amount > 100 and country == 'MX'"
+    :type expression: str
+    :return: the rows matching the expression
+    :rtype: pd.DataFrame
+    """
+    mask = df.eval(expression)
+    if not isinstance(mask, pd.Series) or not pd.api.types.is_bool_dtype(mask):
+        raise ValueError("the expression is not a boolean condition")
+    return df[mask]
+
+
+def where_columns(expression: str, header: List[str]) -> List[str]:
+    """the columns used by a --where expression (a name inside a string literal is a harmless extra)"""
+    return [x for x in header
+            if f"`{x}`" in expression or re.search(rf"(?<![\w.`]){re.escape(x)}(?![\w`])", expression)]
+
+
+def process(df: pd.DataFrame, columns: List[str], where: Optional[str] = None,
+            filter_str: str = NO_FILTER) -> pd.DataFrame:
+    """apply the --where expression, select the columns and apply the --filter lambda"""
+    # Apply the vectorized filter (it may use columns that are not in the output)
+    if where:
+        try:
+            df = apply_where(df, where)
+        except Exception as e:
+            raise ValueError(f"Error applying where expression '{where}': {e}") from e
+
+    # Apply filter
+    df = df[columns]
+    if filter_str.strip() != NO_FILTER and len(df) > 0:
+        try:
+            df = df[df.apply(eval(filter_str), axis=1)]
+        except Exception as e:
+            raise ValueError(f"Error applying filter expression '{filter_str}': {e}") from e
+    return df
+
+
+# the aggregations of `csvc agg` and how their partial values (of chunks or processes) are merged
+AGGREGATIONS = ("sum", "count", "mean", "min", "max")
+MERGE = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+# rows of every chunk aggregated at once when --chunksize is not given
+AGG_CHUNKSIZE = 1_000_000
+# rows of every chunk added to the sort when --chunksize is not given
+SORT_CHUNKSIZE = 100_000
+# bytes of the csv parsed by every task of `csvc agg --jobs`
+RANGE_SIZE = 64 * 1024 * 1024
+
+
+def parse_aggregations(spec: str) -> List[Tuple[str, str]]:
+    """`sum:amount,count:*,mean:price` -> [("sum", "amount"), ("count", "*"), ("mean", "price")]"""
+    aggregations = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        fn, sep, column = item.strip().partition(":")
+        fn, column = fn.strip().lower(), column.strip()
+        if not sep or fn not in AGGREGATIONS or not column or (column == "*" and fn != "count"):
+            raise ValueError(f"invalid aggregation '{item}', use FUNCTION:COLUMN with FUNCTION in "
+                             f"{', '.join(AGGREGATIONS)} (count:* counts the rows)")
+        aggregations.append((fn, column))
+    return aggregations
+
+
+def partial_columns(aggregations: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """the mergeable (function, column) pairs needed by the aggregations, a mean is a sum and a count"""
+    parts = []
+    for fn, column in aggregations:
+        for part in ([("sum", column), ("count", column)] if fn == "mean" else [(fn, column)]):
+            if part not in parts:
+                parts.append(part)
+    return parts
+
+
+def partial_aggregate(df: pd.DataFrame, group_by: List[str], parts: List[Tuple[str, str]]) -> pd.DataFrame:
+    """the partial aggregates of a chunk indexed by the group keys, a column `fn:column` for every part"""
+    keys = [df[x] for x in group_by] if group_by else [np.zeros(len(df), dtype=np.int8)]
+    grouped = df.groupby(keys, dropna=False, sort=False)
+    return pd.DataFrame({f"{fn}:{column}": grouped.size() if column == "*" else grouped[column].agg(fn)
+                         for fn, column in parts})
+
+
+def merge_partials(partials: List[Optional[pd.DataFrame]], parts: List[Tuple[str, str]]) -> Optional[pd.DataFrame]:
+    """merge partial aggregates of the same groups (sums of sums and counts, min of mins, max of maxs)"""
+    partials = [x for x in partials if x is not None]
+    if len(partials) <= 1:
+        return partials[0] if partials else None
+    df = pd.concat(partials)
+    grouped = df.groupby(level=list(range(df.index.nlevels)), dropna=False, sort=False)
+    return grouped.agg({f"{fn}:{column}": MERGE[fn] for fn, column in parts})
+
+
+def finish_aggregate(partial: Optional[pd.DataFrame], group_by: List[str],
+                     aggregations: List[Tuple[str, str]]) -> pd.DataFrame:
+    """the final table: the group columns (sorted) and a `fn:column` column for every aggregation"""
+    parts = partial_columns(aggregations)
+    if partial is None:
+        partial = pd.DataFrame({f"{fn}:{column}": [] for fn, column in parts})
+    result = pd.DataFrame(index=partial.index)
+    for fn, column in aggregations:
+        name = f"{fn}:{column}"
+        result[name] = partial[f"sum:{column}"] / partial[f"count:{column}"] if fn == "mean" else partial[name]
+    if group_by:
+        return result.sort_index().reset_index()
+    if len(result) == 0:
+        # no rows: a single row like the aggregates of an empty column
+        return pd.DataFrame({f"{fn}:{column}": [0 if fn in ("sum", "count") else np.nan] for fn, column in aggregations})
+    return result.reset_index(drop=True)
+
+
+def aggregate_chunks(chunks: Iterator[pd.DataFrame], group_by: List[str], aggregations: List[Tuple[str, str]],
+                     columns: List[str], where: Optional[str] = None,
+                     filter_str: str = NO_FILTER) -> Optional[pd.DataFrame]:
+    """the partial aggregates of the filtered chunks, only the partial aggregates are kept in memory"""
+    parts = partial_columns(aggregations)
+    partial = None
+    for df in chunks:
+        df = process(df, columns, where=where, filter_str=filter_str)
+        partial = merge_partials([partial, partial_aggregate(df, group_by, parts)], parts)
+    return partial
+
+
+def aggregate_range(start: int, end: int, filename: str, header: List[str], usecols: List[str],
+                    dtypes: Dict[str, str], chunksize: int, **kwargs) -> Optional[pd.DataFrame]:
+    """the partial aggregates of the csv lines starting inside the byte range [start, end)"""
+    with open_range_reader(filename) as reader:
+        position, last = line_start(reader, start), line_start(reader, end)
+        data = reader.read(position, last - position)
+    if not data:
+        return None
+    chunks = pd.read_csv(io.BytesIO(data), header=None, names=header, usecols=usecols, dtype=dtypes or None,
+                         chunksize=chunksize)
+    return aggregate_chunks(chunks, **kwargs)
+
+
+def aggregate_row_groups(row_groups: List[int], filename: str, usecols: List[str], dtypes: Dict[str, str],
+                         **kwargs) -> Optional[pd.DataFrame]:
+    """the partial aggregates of some row groups of a parquet file"""
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(filename)
+    chunks = (parquet_file.read_row_group(k, columns=usecols).to_pandas() for k in row_groups)
+    return aggregate_chunks((df.astype(dtypes) if dtypes else df for df in chunks), **kwargs)
+
+
+def aggregate_parallel(filename: str, header: List[str], usecols: List[str], dtypes: Dict[str, str],
+                       skip_rows: int = 0, chunksize: int = AGG_CHUNKSIZE, jobs: int = 2,
+                       **kwargs) -> Optional[pd.DataFrame]:
+    """the partial aggregates of a csv (split in line aligned byte ranges) or a parquet file (split by row groups)
+    computed by `jobs` processes, NotSeekableError if the csv can't be read by ranges (compressed files)
+
+    the ranges are split at newlines: csv files with newlines inside quoted values need jobs=1
+    """
+    if file_format(filename) == "parquet":
+        import pyarrow.parquet as pq
+
+        row_groups = list(range(pq.ParquetFile(filename).num_row_groups))
+        tasks = [row_groups[k::jobs] for k in range(min(jobs, len(row_groups)))]
+        fn = functools.partial(aggregate_row_groups, filename=filename, usecols=usecols, dtypes=dtypes, **kwargs)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            return merge_partials(list(pool.map(fn, tasks)), partial_columns(kwargs["aggregations"]))
+
+    with open_range_reader(filename) as reader:
+        size = reader.size
+        # the data starts after the skipped lines and the header
+        data_start = 0
+        for _ in range(skip_rows + 1):
+            data_start = line_start(reader, data_start + 1)
+    splits = max(jobs, -(-(size - data_start) // RANGE_SIZE))
+    bounds = [data_start + (size - data_start) * k // splits for k in range(splits + 1)]
+    fn = functools.partial(aggregate_range, filename=filename, header=header, usecols=usecols, dtypes=dtypes,
+                           chunksize=chunksize, **kwargs)
+    parts = partial_columns(kwargs["aggregations"])
+    partial = None
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for chunk in pool.map(fn, bounds[:-1], bounds[1:]):
+            partial = merge_partials([partial, chunk], parts)
+    return partial
+
+
 def main(arguments):
-    # load df
+    # load the header
+    filename = arguments['<FILE>']
     try:
         skip_rows = int(arguments['--skip-rows'])
-        df = pd.read_csv(arguments['<FILE>'], skiprows=skip_rows)
+        header = read_header(filename, skip_rows)
     except Exception as e:
         print(Fore.RED + f"File can't be open: {e}")
         exit(1)
 
-    filter_str = arguments["--filter"]
-    filter_fn = eval(arguments['--filter'])
-    include_columns = [x.strip() for x in arguments['--columns'].split(',')]
-    exclude_columns = [x.strip() for x in arguments['--exclude-columns'].split(',')]
-
-    if arguments["--columns"] == "*" and arguments["--exclude-columns"] == "*":
-        print(Fore.RED + "Included Columns and Exclude Columns cannot be both equals to *")
-        exit(1)
-    if arguments["--exclude-columns"] == "*":
-        exclude_columns = df.columns.tolist()
-    elif arguments["--columns"] == "*":
-        include_columns = df.columns.tolist()
-
-    columns = [x for x in include_columns if x not in exclude_columns]
-
     if arguments['--list-columns']:
-        df_columns = df.columns.tolist()
-        for k, xk in enumerate(df_columns):
+        for k, xk in enumerate(header):
             print(f"{k + 1}." + Fore.GREEN + f"'{xk}'")
         return
 
-    if not validate_columns(columns, df):
+    filter_str = arguments["--filter"]
+    if arguments["agg"]:
+        # the group columns and the aggregated columns
+        group_by = [x.strip() for x in (arguments["--group-by"] or "").split(",") if x.strip()]
+        try:
+            aggregations = parse_aggregations(arguments["--agg"])
+        except ValueError as e:
+            print(Fore.RED + str(e))
+            exit(1)
+        columns = list(dict.fromkeys(group_by + [x for _, x in aggregations if x != "*"]))
+    else:
+        include_columns = [x.strip() for x in arguments['--columns'].split(',')]
+        exclude_columns = [x.strip() for x in arguments['--exclude-columns'].split(',')]
+
+        if arguments["--columns"] == "*" and arguments["--exclude-columns"] == "*":
+            print(Fore.RED + "Included Columns and Exclude Columns cannot be both equals to *")
+            exit(1)
+        if arguments["--exclude-columns"] == "*":
+            exclude_columns = header
+        elif arguments["--columns"] == "*":
+            include_columns = header
+
+        columns = [x for x in include_columns if x not in exclude_columns]
+
+    sort_keys, ascending = parse_sort_keys(arguments["--sort-by"]) if arguments["--sort-by"] else ([], [])
+    # the sort keys are read even when they are not in the output
+    sort_columns = columns + [x for x in sort_keys if x not in columns]
+    if not validate_columns(sort_columns, header):
         return
 
-    # Apply filter
-    df = df[columns]
+    where = arguments["--where"]
+    # only the selected columns (and the ones used by --where) are parsed
+    needed = set(sort_columns) | set(where_columns(where, header) if where else [])
+    usecols = [x for x in header if x in needed]
+    chunksize = int(arguments["--chunksize"]) if arguments["--chunksize"] else None
+    # a table can't be aligned before the last chunk, streamed chunks are printed as csv
+    stream_output = chunksize is not None
+    if (arguments["agg"] or sort_keys) and chunksize is None and arguments["--engine"] != "pyarrow":
+        chunksize = AGG_CHUNKSIZE if arguments["agg"] else SORT_CHUNKSIZE
     try:
-        df = df[df.apply(filter_fn, axis=1)]
+        dtypes = parse_dtypes(arguments["--dtypes"])
+        dtypes = {x: y for x, y in dtypes.items() if x in needed}
+        if arguments["agg"] and file_format(filename) == "csv":
+            # every chunk (and range) would infer the type of its keys: 1 and "1" would be different groups
+            for x in group_by:
+                dtypes.setdefault(x, "str")
+        chunks = read_chunks(filename, usecols=usecols, dtypes=dtypes, skip_rows=skip_rows,
+                             engine=arguments["--engine"], chunksize=chunksize)
+        first = next(chunks, None)
     except Exception as e:
-        print(Fore.RED + f"Error applying filter expression '{filter_str}': {e}")
-        return
+        print(Fore.RED + f"File can't be open: {e}")
+        exit(1)
+    chunks = itertools.chain([] if first is None else [first], chunks)
 
-    if arguments['--output'] == "stdout":
-        with pd.option_context(
-                'display.max_rows', None,
-                'display.max_columns', None,
-                'display.width', 0,
-                'display.max_colwidth', None,
-                'display.expand_frame_repr', False
-        ):
-            print(df.to_string(index=False))
-    else:
-        with open(arguments['--output'], 'w') as fp:
-            df.to_csv(fp, index=False)
+    if arguments["agg"]:
+        # a single pass over the chunks keeping only the partial aggregates
+        agg_kwargs = dict(group_by=group_by, aggregations=aggregations, columns=columns, where=where,
+                          filter_str=filter_str)
+        jobs = int(arguments["--jobs"])
+        try:
+            partial = None
+            if jobs > 1 and file_format(filename) != "feather":
+                try:
+                    partial = aggregate_parallel(filename, header, usecols, dtypes, skip_rows=skip_rows,
+                                                 chunksize=chunksize or AGG_CHUNKSIZE, jobs=jobs, **agg_kwargs)
+                    chunks = None
+                except NotSeekableError:
+                    pass
+            if chunks is not None:
+                partial = aggregate_chunks(chunks, **agg_kwargs)
+        except ValueError as e:
+            print(Fore.RED + str(e))
+            return
+        # the result goes through the same output paths (it is a single table)
+        chunks, stream_output = [finish_aggregate(partial, group_by, aggregations)], False
+        columns, where, filter_str = None, None, NO_FILTER
+    elif sort_keys:
+        try:
+            sorter = ExternalSorter(sort_keys, ascending, mem_limit=parse_size(arguments["--mem-limit"]),
+                                    top=int(arguments["--top"]) if arguments["--top"] else None)
+        except ValueError as e:
+            print(Fore.RED + str(e))
+            exit(1)
+        try:
+            for df in chunks:
+                sorter.add(process(df, sort_columns, where=where, filter_str=filter_str))
+        except ValueError as e:
+            print(Fore.RED + str(e))
+            sorter.close()
+            return
+        # the sorted blocks (of the merged runs when they were spilled) without the extra sort keys
+        # printed as csv whether it was spilled or not, the output doesn't depend on --mem-limit
+        stream_output = True
+        output_columns = columns
+        chunks = (df[output_columns] for df in sorter.sorted_blocks())
+        columns, where, filter_str = None, None, NO_FILTER
+
+    writer = None if arguments['--output'] == "stdout" else TableWriter(arguments['--output'])
+    if writer is None and stream_output:
+        writer = TableWriter(sys.stdout, fmt="csv")
+    try:
+        for df in chunks:
+            if columns is not None:
+                try:
+                    df = process(df, columns, where=where, filter_str=filter_str)
+                except ValueError as e:
+                    print(Fore.RED + str(e))
+                    return
+
+            if writer is not None:
+                try:
+                    writer.write(df)
+                except ValueError as e:
+                    # a later chunk inferred another type for a column of the parquet/feather file
+                    print(Fore.RED + str(e))
+                    exit(1)
+            else:
+                with pd.option_context(
+                        'display.max_rows', None,
+                        'display.max_columns', None,
+                        'display.width', 0,
+                        'display.max_colwidth', None,
+                        'display.expand_frame_repr', False
+                ):
+                    print(df.to_string(index=False))
+    except BrokenPipeError:
+        exit_on_broken_pipe()
+    finally:
+        if writer is not None:
+            writer.close()
 
 
 if __name__ == '__main__':
@@ -1,7 +1,8 @@
 """CSV Obfuscator
 
 Usage:
-    csvobf.py [--no-obf] [--output=PATH] [--force] [--cols=NAMES] [--p-empty-rows=P] [--p-obf=P] [--p-fill=P] <FILENAME>
+    csvobf.py [--no-obf] [--output=PATH] [--force] [--cols=NAMES] [--p-empty-rows=P] [--p-obf=P] [--p-fill=P] [--seed=N]
+              [--chunksize=N] [--jobs=N] [--format=FORMAT] <FILENAME>
 
 Arguments:
     <FILENAME>         The CSV file to process.
@@ -10,162 +11,56 @@ Options:
     --no-obf           Don't obfuscate CSV file.
     --force            Enforce to write the output file if it already exists.
     --output=PATH      Output file path. If omitted, prints to stdout.
+    --format=FORMAT    Output format: csv, parquet or feather. By default it is taken from the extension of the
+                       output path (.parquet/.pq, .feather/.arrow), otherwise csv.
     --cols=NAMES       Comma-separated list of columns to obfuscate. If omitted, all columns are obfuscated.
     --p-empty-rows=P   Probability of obfuscating empty rows [default: 0.2].
     --p-obf=P          Probability of substituting a character during obfuscation [default: 0.01].
-    --p-fill=P         Probability of fill with empty character during obfuscation [default: 0.01].
+    --p-fill=P         Deprecated and ignored, it never changed the output (kept for the existing scripts).
+    --seed=N           Seed of the random generator, the same seed (and chunk size) gives the same output.
+    --chunksize=N      Rows read and obfuscated at a time, the memory is bounded by the chunk size [default: 100000].
+    --jobs=N           Processes obfuscating the chunks, 0 uses all the CPUs [default: 0].
 """
 import os
 import sys
-from collections import defaultdict
 
+import numpy as np
 import pandas as pd
-from random import random, choice, randint
 from docopt import docopt
 
+from utils.obfuscation import obfuscate_chunks
+from utils.output import exit_on_broken_pipe
+from utils.tables import TableWriter, file_format
 
-class Homoglyph:
-    HOMOGLYPHS = {
-        # Lowercase
-        "a": ["а"],  # Cyrillic a
-        "c": ["с"],  # Cyrillic es
-        "e": ["е"],  # Cyrillic ie
-        "g": ["ɡ"],  # Latin small letter script g (confusable)
-        "i": ["і"],  # Cyrillic i
-        "j": ["ј"],  # Cyrillic je
-        "l": ["ⅼ"],  # Roman numeral fifty
-        "o": ["о"],  # Cyrillic o
-        "p": ["р"],  # Cyrillic er
-        "q": ["ԛ"],  # Cyrillic qa
-        "s": ["ѕ"],  # Cyrillic dze
-        "u": ["υ"],  # Greek upsilon
-        "v": ["ν"],  # Greek nu
-        "x": ["х"],  # Cyrillic ha
-        "y": ["у"],  # Cyrillic u
-        "z": ["ᴢ"],  # Modifier small capital Z
-
-        # Uppercase
-        "A": ["Α", "А"],  # Greek Alpha, Cyrillic A
-        "B": ["Β", "В"],  # Greek Beta, Cyrillic Ve
-        "C": ["Ϲ", "С"],  # Greek Sigma, Cyrillic Es
-        "D": ["Ꭰ"],  # Cherokee A
-        "E": ["Ε", "Е"],  # Greek Epsilon, Cyrillic Ie
-        "H": ["Η", "Н"],  # Greek Eta, Cyrillic En
-        "I": ["Ι", "І"],  # Greek Iota, Cyrillic I
-        "J": ["Ј"],  # Cyrillic Je
-        "K": ["Κ", "К"],  # Greek Kappa, Cyrillic Ka
-        "L": ["Ꮮ"],  # Cherokee L
-        "M": ["Μ", "М"],  # Greek Mu, Cyrillic Em
-        "N": ["Ν"],  # Greek Nu
-        "O": ["Ο", "О"],  # Greek Omicron, Cyrillic O
-        "P": ["Ρ", "Р"],  # Greek Rho, Cyrillic Er
-        "Q": ["Ԛ"],  # Cyrillic Qa
-        "S": ["Ѕ"],  # Cyrillic Dze
-        "T": ["Τ", "Т"],  # Greek Tau, Cyrillic Te
-        "U": ["Ս"],  # Armenian Se
-        "X": ["Χ", "Х"],  # Greek Chi, Cyrillic Ha
-        "Y": ["Υ"],  # Greek Upsilon, Cyrillic U
-        "Z": ["Ζ"],  # Greek Zeta
-
-        # Digits
-        "0": ["О"],  # Cyrillic O
-        "3": ["З"],  # Cyrillic Ze
-
-        # Symbols
-        "-": ["‐"],  # Hyphen-like
-        "_": ["＿"],  # Fullwidth underscore
-    }
-
-    @classmethod
-    def random_map(cls, c):
-        if c in cls.HOMOGLYPHS:
-            return choice(cls.HOMOGLYPHS[c])
-        return None
-
-    @classmethod
-    def random_sub(cls, text: str, probability: float = 0.3) -> tuple[str, bool]:
-        new_text = ""
-        changed = False
-        for c in text:
-            if random() < probability:
-                mapped_c = cls.random_map(c)
-                if mapped_c:
-                    changed = True
-                    new_text += mapped_c
-                else:
-                    new_text += c
-            else:
-                new_text += c
-        return new_text, changed
-
-
-def obfuscate(df: pd.DataFrame, col_names_and_flags, p_obf, p_empty, p_fill) -> pd.DataFrame:
-    only_col_names = [x for x, _ in col_names_and_flags]
-
-    # 4. obfuscate cells
-    counter = defaultdict(int)
-    for k, row in df.iterrows():
-        for col_name, obfuscate_flag in col_names_and_flags:
-            if obfuscate_flag:
-                original_value = row[col_name]
-                new_value, changed = Homoglyph.random_sub(original_value, probability=p_obf)
-                row[col_name] = new_value
-                counter[col_name] += 1
-
-    # 5. obf  spaces to , and ;
-    for k, row in df.iterrows():
-        for c in only_col_names:
-            val = row[c]
-            new_val = ""
-            for ci in val:
-                if ci == " " and random() < 0.35:
-                    ci = ", " if random() < 0.5 else "; "
-                new_val += ci
-            row[c] = new_val
-
-    new_id = 0
-    new_rows = []
-    for k, row in df.iterrows():
-        new_id += 1
-        row_dict = {k: v for k, v in row.items()}
-        row_dict["id"] = new_id
-        new_rows.append(row_dict)
-
-        if random() < p_empty:
-            for _ in range(randint(3, 10)):
-                new_id += 1
-                row_dict = {k: "" for k, v in row.items()}
-                row_dict["id"] = new_id
-                new_rows.append(row_dict)
-
-    new_df = pd.DataFrame(new_rows)
-    return new_df
-
-
-def df_to_text(df):
-    lines = [",".join([c for c in df.columns])]
-    for k, row in df.iterrows():
-        current_line = [str(v) for k, v in row.items()]
-        lines.append(",".join(current_line))
-    return "\n".join(lines)
+JOBS = os.cpu_count() or 1
+FORMATS = ("csv", "parquet", "feather")
 
 
 def main():
     arguments = docopt(__doc__)
     p_obf = float(arguments["--p-obf"]) if arguments["--p-obf"] is not None else 0.0
     p_empty = float(arguments["--p-empty-rows"]) if arguments["--p-empty-rows"] is not None else 0.0
-    p_fill = float(arguments["--p-fill"]) if arguments["--p-fill"] is not None else 0.0
 
     if arguments["--no-obf"]:
-        p_obf, p_empty, p_empty = 0, 0, 0
+        p_obf, p_empty = 0, 0
+
+    try:
+        # without a seed every run is different, the chunks still derive their seeds from a single one
+        seed = int(arguments["--seed"]) if arguments["--seed"] is not None else np.random.SeedSequence().entropy
+        chunksize = int(arguments["--chunksize"])
+        jobs = int(arguments["--jobs"]) or JOBS
+    except ValueError as e:
+        print(f"Invalid argument: {e}", file=sys.stderr)
+        exit(1)
 
-    # 1. read the csv file
-    df = pd.read_csv(arguments["<FILENAME>"], dtype=str).fillna("NAN")
+    # 1. read the header of the csv file
+    filename = arguments["<FILENAME>"]
+    header = pd.read_csv(filename, dtype=str, nrows=0).columns.tolist()
 
     # 2. read the columns
     if not arguments["--cols"]:
         # obfuscate all columns
-        col_names_and_flags = [(x, True) for x in df.columns]
+        col_names_and_flags = [(x, True) for x in header]
     else:
         col_names_and_flags = []
         for col in arguments["--cols"].split(","):
@@ -178,30 +73,44 @@ def main():
                     col_obfuscate = True
             col_names_and_flags.append((col_name, col_obfuscate))
 
-    # 3. filter out only the valid column names
-    col_names_and_flags = [(x, f) for x, f in col_names_and_flags if x in df.columns]
+    # 3. all the column names must exist
     exit_flag = False
-    for x, f in [(x, f) for x, f in col_names_and_flags if x not in df.columns]:
+    for x, f in [(x, f) for x, f in col_names_and_flags if x not in header]:
         print(f"Column '{x}' does not exist in CSV file", file=sys.stderr)
         exit_flag = True
     if exit_flag:
         exit(1)
 
-    df = df[[x for x, _ in col_names_and_flags]]
+    output = arguments["--output"]
+    if output and not arguments["--force"] and os.path.exists(output):
+        print(f"Output file '{output}' already exists", file=sys.stderr)
+        exit(1)
+    fmt = arguments["--format"] or (file_format(output) if output else "csv")
+    if fmt not in FORMATS:
+        print(f"Unknown format '{fmt}', use one of {', '.join(FORMATS)}", file=sys.stderr)
+        exit(1)
+    if not output and fmt != "csv" and sys.stdout.isatty():
+        print(f"Can't write {fmt} to a terminal, use --output or a pipe", file=sys.stderr)
+        exit(1)
+
+    # 4. read the selected columns in chunks
+    col_names = [x for x, _ in col_names_and_flags]
+    chunks = (df[col_names].fillna("NAN")
+              for df in pd.read_csv(filename, dtype=str, usecols=col_names, chunksize=chunksize))
 
+    # 5. obfuscate the chunks in a pool of processes, they come back in order
     if not arguments["--no-obf"]:
-        df = obfuscate(df, col_names_and_flags, p_obf, p_empty, p_fill)
-
-    # print out the df
-    if arguments["--output"]:
-        if arguments["--force"] or not os.path.exists(arguments["--output"]):
-            with open(arguments["--output"], "w") as fp:
-                fp.write(df_to_text(df))
-        else:
-            print(f"Output file '{arguments['--output']}' already exists", file=sys.stderr)
-            exit(1)
-    else:
-        print(df_to_text(df), file=sys.stderr)
+        chunks = obfuscate_chunks(chunks, col_names_and_flags, p_obf, p_empty, seed=seed, jobs=jobs)
+
+    # 6. write the chunks (quoted csv, or parquet/feather with the schema of the first chunk) to the file or stdout
+    writer = TableWriter(output if output else sys.stdout.buffer, fmt=fmt)
+    try:
+        for df in chunks:
+            writer.write(df)
+    except BrokenPipeError:
+        exit_on_broken_pipe()
+    finally:
+        writer.close()
 
 
 if __name__ == '__main__':
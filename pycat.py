@@ -1,55 +1,204 @@
 """execute the cat command for a cloud file (actually any cloud file) or local file
 
 Usage:
-  pycat [--jsonl] [--offset=A] [--limit=N] [--nl-at-end] <FILENAME>
+  pycat [--jsonl] [--offset=A] [--limit=N] [--nl-at-end] [--index] [--headers] [--prefetch=K]
+        [--fields=LIST] [--where=EXPR]... [--validate] [<FILENAME>...]
+  pycat --grep=REGEX [--line-number] [--byte-offset] [--ignore-case] [--jobs=N] [--limit=N] [--headers]
+        [<FILENAME>...]
 
 Arguments:
-    <FILENAME>              input filename to be processed (local, cloud)
+    <FILENAME>              input filenames to be processed (local, cloud), stdin if omitted,
+                            local globs (data/part-*.jsonl) and cloud patterns or prefixes
+                            (s3://bucket/prefix/part-*.jsonl.gz, gs://bucket/prefix/) are expanded
 
 Options:
     -o A, --offset=A           start reading from line A [default: 0]
     -l N, --limit=N            only reads up to N lines
     -j, --jsonl                read a jsonl file, i.e. avoid empty lines
     --nl-at-enf                a flag to add a new line at the end
+    -i, --index                use (and update) the line index of the file to jump to the offset,
+                               a `<FILENAME>.pycat.idx` sidecar for local files or ~/.cache/pycat for cloud files
+    --headers                  print a `==> FILENAME <==` header before every file
+    --prefetch=K               download the next K cloud files while the current one is printed [default: 4]
+    -F LIST, --fields=LIST     print only these fields of every record (implies --jsonl), e.g. `user.id,ts`,
+                               as a json object keyed by the given names
+    -w EXPR, --where=EXPR      print only the records matching the expression (implies --jsonl), it can be repeated:
+                               `status == 500`, `latency_ms >= 1.5`, `user.name ~ ^adm`, `error`, `!retry`
+    --validate                 report the malformed lines (with their line number) to stderr and skip them,
+                               otherwise the first malformed line stops pycat when --fields or --where are used
+    -g REGEX, --grep=REGEX     print only the lines matching the regex, seekable files are split in line aligned
+                               byte ranges searched by a pool of processes (the output keeps the file order)
+    -n, --line-number          prefix the matching lines with their line number (starting at 1)
+    -b, --byte-offset          prefix the matching lines with the byte offset where they start
+    --ignore-case              case insensitive --grep
+    --jobs=N                   processes used by --grep, 0 means one per core [default: 0]
+
+The offset and the limit are applied to every file, they select the lines before the --where filter,
+with --grep the limit is the number of matching lines printed.
 """
+import contextlib
+import io
+import itertools
+import os
+import re
 import sys
 
-import smart_open
 from docopt import docopt
-from typing import Optional
+from typing import IO, List, Optional
 
+from utils.grep import JOBS, grep_file
+from utils.inputs import expand_inputs, open_stream, prefetch_inputs
+from utils.jsonl import JsonlProcessor, MalformedLineError, parse_fields, parse_where
+from utils.lineindex import LineIndex
+from utils.output import BlockWriter
+from utils.rangeio import NotSeekableError, RangeStream, open_range_reader, is_stdin
 
-def cat(filename: Optional[str], offset: int = 0, limit: Optional[int] = None, is_jsonl: bool = False, nl_at_end:bool=False):
-    """Cat operation of given filename"""
-    if filename is None:
-        fp = sys.stdin
-    else:
-        fp = smart_open.open(filename)
+# bytes read at once after the seek
+CHUNK_SIZE = 1024 * 1024
+# lines parsed at once by the jsonl processor
+BATCH_LINES = 4096
+
+
+def open_at_line(filename: str, offset: int) -> (IO, int):
+    """opens the file positioned at the nearest indexed line before `offset`
+
+    :param filename: the local or cloud file
+    :type filename: str
+    :param offset: the first line to be read
+    :type offset: int
+    :return: the binary file pointer and the line number where it is positioned
+    :rtype: (IO, int)
+    """
+    try:
+        reader = open_range_reader(filename)
+        index = LineIndex.open(filename, reader)
+    except NotSeekableError:
+        # gzip, bz2 or xz files can't be seeked: read them from the start
+        return open_stream(filename), 0
 
-    for k, line_k in enumerate(fp):
-        if k < offset:
-            continue
-        if limit and k >= offset + limit:
+    byte_offset, skip = index.locate(offset)
+    # a local read or ranged requests for cloud files (of the decompressed frames for seekable formats)
+    return io.BufferedReader(RangeStream(reader, byte_offset), CHUNK_SIZE), offset - skip
+
+
+def cat_lines(fp: IO, writer: BlockWriter, offset: int = 0, limit: Optional[int] = None, is_jsonl: bool = False,
+              first_line: int = 0, processor: Optional[JsonlProcessor] = None, filename: Optional[str] = None):
+    """copies the lines [offset, offset + limit) of a binary stream positioned at the line `first_line`
+
+    the lines go through the jsonl processor (in batches) when it is given
+    """
+    start = max(0, offset - first_line)
+    lines = itertools.islice(fp, start, start + limit if limit else None)
+    if processor is None:
+        for line_k in lines:
+            # avoid empty lines only if a jsonl flag is active
+            if is_jsonl and not line_k.strip():
+                continue
+            writer.write_line(line_k)
+        return
+
+    line_number = first_line + start
+    while True:
+        batch = list(itertools.islice(lines, BATCH_LINES))
+        if not batch:
             break
-        # avoid empty lines only if a jsonl flag is active
-        if is_jsonl and not line_k.strip():
-            continue
-        end = "" if str(line_k).endswith("\n") else "\n"
-        print(line_k, end=end)
+        writer.write(processor.process(batch, first_line=line_number, filename=filename))
+        line_number += len(batch)
 
-    if nl_at_end:
-        print("")
 
-    fp.close()
+def _indexed_inputs(filenames: List[Optional[str]], offset: int):
+    """yield (filename, binary file pointer, first line) jumping to the offset through the line index"""
+    for filename in filenames:
+        if is_stdin(filename):
+            fp, first_line = sys.stdin.buffer, 0
+        else:
+            fp, first_line = open_at_line(filename, offset)
+        try:
+            yield filename, fp, first_line
+        finally:
+            if fp is not sys.stdin.buffer:
+                fp.close()
+
+
+def cat(filenames: List[Optional[str]], offset: int = 0, limit: Optional[int] = None, is_jsonl: bool = False,
+        nl_at_end: bool = False, use_index: bool = False, headers: bool = False, prefetch: int = 4,
+        processor: Optional[JsonlProcessor] = None):
+    """Cat operation of the given filenames (None for stdin), the lines are copied as raw bytes in large blocks"""
+    if use_index and offset > 0:
+        inputs = _indexed_inputs(filenames, offset)
+    else:
+        inputs = ((filename, fp, 0) for filename, fp in prefetch_inputs(filenames, prefetch=prefetch))
+
+    with BlockWriter() as writer:
+        for k, (filename, fp, first_line) in enumerate(inputs):
+            if headers:
+                writer.write_header(filename, first=k == 0)
+            cat_lines(fp, writer, offset=offset, limit=limit, is_jsonl=is_jsonl, first_line=first_line,
+                      processor=processor, filename=filename)
+
+        if nl_at_end:
+            writer.write(b"\n")
+
+
+def grep(filenames: List[Optional[str]], pattern: bytes, flags: int = 0, line_numbers: bool = False,
+         byte_offsets: bool = False, limit: Optional[int] = None, headers: bool = False, jobs: int = JOBS):
+    """prints the lines of the files matching the regex in file order, optionally with their line number and offset
+
+    :param filenames: the files to be searched (None for stdin)
+    :type filenames: List[Optional[str]]
+    :param pattern: the byte regex
+    :type pattern: bytes
+    :param flags: re flags
+    :type flags: int
+    :param line_numbers: prefix the lines with `N:`
+    :type line_numbers: bool
+    :param byte_offsets: prefix the lines with `OFFSET:` (after the line number)
+    :type byte_offsets: bool
+    :param limit: the maximum number of matching lines of every file
+    :type limit: Optional[int]
+    :param headers: print a `==> FILENAME <==` header before every file
+    :type headers: bool
+    :param jobs: the number of processes
+    :type jobs: int
+    """
+    with BlockWriter() as writer:
+        for k, filename in enumerate(filenames):
+            if headers:
+                writer.write_header(filename, first=k == 0)
+            fp = sys.stdin.buffer if is_stdin(filename) else None
+            with contextlib.closing(grep_file(filename, pattern, flags, jobs=jobs, fp=fp)) as matches:
+                for match in itertools.islice(matches, limit):
+                    prefix = f"{match.line}:" if line_numbers else ""
+                    prefix += f"{match.offset}:" if byte_offsets else ""
+                    writer.write_line(prefix.encode("utf8") + match.text if prefix else match.text)
 
 
 def main(**kwargs):
     args = docopt(doc=__doc__, **kwargs)
 
-    arg_filename = args["<FILENAME>"]
+    arg_filenames = expand_inputs(args["<FILENAME>"])
     arg_offset = int(args["--offset"])
     arg_limit = int(args["--limit"]) if args["--limit"] else None
-    cat(arg_filename, offset=arg_offset, limit=arg_limit, is_jsonl=args["--jsonl"], nl_at_end=args["--nl-at-end"])
+
+    if args["--grep"] is not None:
+        grep(arg_filenames, os.fsencode(args["--grep"]), flags=re.IGNORECASE if args["--ignore-case"] else 0,
+             line_numbers=args["--line-number"], byte_offsets=args["--byte-offset"], limit=arg_limit,
+             headers=args["--headers"], jobs=int(args["--jobs"]) or JOBS)
+        return
+
+    processor = None
+    if args["--fields"] or args["--where"] or args["--validate"]:
+        processor = JsonlProcessor(fields=parse_fields(args["--fields"]) if args["--fields"] else None,
+                                   where=[parse_where(x) for x in args["--where"]], validate=args["--validate"])
+    try:
+        cat(arg_filenames, offset=arg_offset, limit=arg_limit, is_jsonl=args["--jsonl"], nl_at_end=args["--nl-at-end"],
+            use_index=args["--index"], headers=args["--headers"], prefetch=int(args["--prefetch"]), processor=processor)
+    except MalformedLineError as e:
+        print(f"pycat: {e}, use --validate to skip the malformed lines", file=sys.stderr)
+        sys.exit(1)
+    if processor is not None and processor.malformed:
+        print(f"pycat: {processor.malformed} malformed lines", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
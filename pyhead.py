@@ -1,19 +1,33 @@
 """execute the head command for a cloud file (actually any cloud file) or local file
 
 Usage:
-  pyhead [-n LINES]
-  pyhead [-n LINES] <FILENAME>
+  pyhead [-n LINES] [--stats] [--headers] [<FILENAME>...]
 
 Options:
     -n LINES                set the limit of head-lines to be processed [default: 10], should be a positive value.
-    <FILENAME>              input filename to be processed (local or cloud)
+    --stats                 report the bytes transferred (and the ranged requests) to stderr
+    --headers               print a `==> FILENAME <==` header before every file
+    <FILENAME>              input filenames to be processed (local or cloud), stdin if omitted,
+                            local globs and cloud patterns or prefixes (s3://bucket/prefix/) are expanded
+
+Seekable files (local, s3, gs, http with byte ranges) are fetched with small ranged reads
+that grow from 64 KiB (x4 every time) until the N lines are complete,
+gzip, bz2 and xz files (and stdin) are streamed.
 """
 import sys
-from typing import Dict, List, Type, IO
+from typing import Dict, List, Optional, Type, IO
 
-import smart_open
 from docopt import docopt
 
+from utils.inputs import expand_inputs, open_stream
+from utils.output import BlockWriter
+from utils.rangeio import RangeReader, NotSeekableError, open_range_reader, is_stdin
+
+# the first ranged read, every new read is GROWTH times bigger up to MAX_BLOCK_SIZE
+BLOCK_SIZE = 64 * 1024
+GROWTH = 4
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
 
 def str2num(text: str, default=None, class_type: Type = int):
     val = default
@@ -26,20 +40,59 @@ def str2num(text: str, default=None, class_type: Type = int):
     return val
 
 
-def head(fp: IO, n: int = 10):
-    """prints the head-lines (default 10) of the given file `filename`
+def head(fp: IO, n: int = 10, writer: Optional[BlockWriter] = None) -> int:
+    """prints the head-lines (default 10) of the given binary file pointer `fp`
 
-    :param filename: the local or cloud file
-    :type filename: str
+    :param fp: the binary file pointer of the local or cloud file
+    :type fp: IO
     :param n: the number of lines to be printed (default=10)
     :type n: int
+    :param writer: the output (a new stdout writer if None)
+    :type writer: BlockWriter
+    :return: the number of bytes printed
+    :rtype: int
+    """
+    total = 0
+    # open the file and only walk over the first n lines or when the file ends
+    with writer or BlockWriter() as writer:
+        for _, line in zip(range(n), fp):
+            writer.write(line)
+            total += len(line)
+    return total
+
+
+def head_ranged(reader: RangeReader, n: int = 10, writer: Optional[BlockWriter] = None, block_size: int = BLOCK_SIZE):
+    """prints the head-lines (default 10) of a seekable file fetching growing byte ranges
+
+    nothing past the block holding the n-th newline is requested, so the first lines
+    of a huge cloud object cost a few kilobytes
+
+    :param reader: the ranged reader of the file
+    :type reader: RangeReader
+    :param n: the number of lines to be printed (default=10)
+    :type n: int
+    :param writer: the output (a new stdout writer if None)
+    :type writer: BlockWriter
+    :param block_size: the size of the first ranged read
+    :type block_size: int
     :return: nothing
     :rtype: None
     """
-    # open the file and only walk over the first n lines or when the file ends
-    for _, line in zip(range(n), fp):
-        # end = "" if str(line).endswith("\n") else "\n"
-        print(line, end="")
+    position = 0
+    with writer or BlockWriter() as writer:
+        while n > 0 and position < reader.size:
+            block = reader.read(position, block_size)
+            position += len(block)
+            newlines = block.count(b"\n")
+            if newlines >= n:
+                # cut the block right after the n-th newline
+                end = -1
+                for _ in range(n):
+                    end = block.find(b"\n", end + 1)
+                block = block[:end + 1]
+            n -= newlines
+            writer.write(block)
+            block_size = min(GROWTH * block_size, MAX_BLOCK_SIZE)
 
 
 def main(**kwargs: Dict or List):
@@ -54,14 +107,33 @@ def main(**kwargs: Dict or List):
     """
     arguments = docopt(doc=__doc__, **kwargs)
 
-    arg_filename = arguments["<FILENAME>"]
+    arg_filenames = expand_inputs(arguments["<FILENAME>"])
     arg_n = arguments["-n"]
     n = str2num(arg_n, default=None, class_type=int)
     if n is None or n < 1:
         raise ValueError("-n N must be an integer number greater than 0")
 
-    fp = smart_open.smart_open(arg_filename, "r") if arg_filename is not None else sys.stdin
-    head(fp, n)
+    transferred, requests, streamed = 0, 0, 0
+    with BlockWriter() as writer:
+        for k, filename in enumerate(arg_filenames):
+            if arguments["--headers"]:
+                writer.write_header(filename, first=k == 0)
+            if is_stdin(filename):
+                streamed += head(sys.stdin.buffer, n, writer)
+                continue
+            try:
+                with open_range_reader(filename) as reader:
+                    head_ranged(reader, n, writer)
+                transferred += reader.bytes_read
+                requests += reader.requests
+            except NotSeekableError:
+                # fallback: stream the file
+                with open_stream(filename) as fp:
+                    streamed += head(fp, n, writer)
+
+    if arguments["--stats"]:
+        print(f"pyhead: {transferred} bytes transferred in {requests} ranged requests, {streamed} bytes streamed",
+              file=sys.stderr)
 
 
 if __name__ == '__main__':
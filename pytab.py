@@ -1,8 +1,8 @@
 """print CSV with rainbow colors using TABULATE
 
 Usage:
-  pytab [--colors NAMES]
-  pytab [--colors NAMES] <FILENAME>
+  pytab [--colors NAMES] [--max-rows=N] [--sample=K] [--width=W]
+  pytab [--colors NAMES] [--max-rows=N] [--sample=K] [--width=W] <FILENAME>
 
 Arguments:
     <FILENAME>              input filename to be processed (local, cloud) use a single dash to use stdin [default: -]
@@ -13,23 +13,125 @@ Options:
                             [default: cyan,yellow,magenta,white,lightred,lightgreen,lightblue]
                             available color names are: red,green,blue,cyan,magenta,yellow,white,black
                             and "light" prefix version of them like "lightred" or "lightcyan"
+    --max-rows=N            print only the first N rows
+    --sample=K              rows read before printing to compute the column widths [default: 1000]
+    --width=W               maximum width of the table, the terminal width by default (no limit in a pipe),
+                            the widest columns are narrowed to fit and longer cells are truncated with `…`
+
+The table is streamed: the first K rows fix the column widths (and the numeric columns aligned to the right),
+the rest of the rows are printed as they are read, cells wider than their column are truncated.
 """
 
+import csv
+import io
+import shutil
 import sys
-from itertools import cycle
-from typing import IO, List
+from itertools import chain, cycle, islice
+from typing import IO, Iterator, List, Optional, Tuple
 
-import smart_open
-import pandas as pd
+from colorama import Style
 from docopt import docopt
-from tabulate import tabulate
 
-from utils.cprint import cformat
+from utils.cprint import style_prefix
+from utils.inputs import open_stream
+from utils.output import exit_on_broken_pipe
 
 default_color_list = [
     "cyan", "yellow", "magenta", "white", "lightred", "lightgreen", "lightblue"
 ]
 
+# the separator between columns (like tabulate)
+SEPARATOR = "  "
+# rows written at once
+WRITE_ROWS = 256
+# a column is never narrowed below this width
+MIN_WIDTH = 3
+ELLIPSIS = "…"
+
+
+def is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def column_layout(header: List[str], sample: List[List[str]]) -> Tuple[List[int], List[bool]]:
+    """the width of every column and if it is numeric (every non empty value of the sample is a number)"""
+    widths = [len(x) for x in header]
+    numeric = [True] * len(header)
+    for row in sample:
+        for k, cell in enumerate(row[:len(header)]):
+            widths[k] = max(widths[k], len(cell))
+            numeric[k] = numeric[k] and (not cell or is_number(cell))
+    return widths, numeric
+
+
+def fit_widths(widths: List[int], max_width: int) -> List[int]:
+    """narrow the widest columns until the table fits in `max_width` characters (0 means no limit)"""
+    available = max_width - len(SEPARATOR) * (len(widths) - 1)
+    if max_width <= 0 or sum(widths) <= available:
+        return widths
+    # the largest cap such that the capped columns fit
+    low, high = MIN_WIDTH, max(widths)
+    while low < high:
+        cap = (low + high + 1) // 2
+        if sum(min(x, cap) for x in widths) <= available:
+            low = cap
+        else:
+            high = cap - 1
+    return [min(x, low) for x in widths]
+
+
+def stream_table(rows: Iterator[List[str]], color_list: List[str] = None, sample: int = 1000,
+                 max_rows: Optional[int] = None, max_width: int = 0, colored: bool = True) -> Iterator[str]:
+    """yield the lines of the colorized table of the csv rows (the first one is the header)
+
+    :param rows: the csv rows, the first row is the header
+    :type rows: Iterator[List[str]]
+    :param color_list: list of valid color to iterate on every column
+    :type color_list: List[str]
+    :param sample: the rows used to compute the column widths
+    :type sample: int
+    :param max_rows: the maximum number of rows (None for all of them)
+    :type max_rows: Optional[int]
+    :param max_width: the maximum width of the lines (0 means no limit)
+    :type max_width: int
+    :param colored: add the ansi colors
+    :type colored: bool
+    :return: the lines of the table (without the newline)
+    :rtype: Iterator[str]
+    """
+    color_list = default_color_list if color_list is None else color_list
+    header = next(rows, None)
+    if header is None:
+        return
+    rows = islice(rows, max_rows)
+    head = list(islice(rows, sample))
+    widths, numeric = column_layout(header, head)
+    widths = fit_widths(widths, max_width)
+
+    # the ansi prefixes are computed once per column, not per cell
+    colors = list(islice(cycle(color_list), len(header)))
+    header_prefixes = [style_prefix(fg_color=color, style="BRIGHT") if colored else "" for color in colors]
+    prefixes = [style_prefix(fg_color=color, style="NORMAL") if colored else "" for color in colors]
+    reset = Style.RESET_ALL if colored else ""
+
+    def render(cells: List[str], prefixes_k: List[str]) -> str:
+        parts = []
+        for width, right, prefix, cell in zip(widths, numeric, prefixes_k, chain(cells, cycle([""]))):
+            if len(cell) > width:
+                # a column empty in the sample (header included) has no room even for the ellipsis
+                cell = cell[:width - 1] + ELLIPSIS if width > 0 else ""
+            parts.append(prefix + (cell.rjust(width) if right else cell.ljust(width)))
+        return SEPARATOR.join(parts).rstrip() + reset
+
+    yield render(header, header_prefixes)
+    yield SEPARATOR.join("-" * width for width in widths)
+    for row in chain(head, rows):
+        yield render(row, prefixes)
+
 
 def fs_tabulate(fp: IO, color_list: List[str] = None) -> str:
     """given the input file (as a pointer) and a list of colors (none to take a default list)
@@ -42,22 +144,7 @@ def fs_tabulate(fp: IO, color_list: List[str] = None) -> str:
     :return: the tabulated string colorized by columns
     :rtype: str
     """
-    color_list = default_color_list if color_list is None else color_list
-    df = pd.read_csv(fp)
-    columns = df.columns
-    values: List[List[str]] = df.values.tolist()
-
-    colored_columns = [
-        cformat(column, fg_color=color, style="BRIGHT")
-        for color, column in zip(cycle(color_list), columns)
-    ]
-    colored_values = [[
-        cformat(cell, fg_color=color, style="NORMAL")
-        for color, cell in zip(cycle(color_list), row)
-    ] for row in values]
-
-    text = tabulate(colored_values, headers=colored_columns)
-    return text
+    return "\n".join(stream_table(csv.reader(fp), color_list=color_list, sample=sys.maxsize))
 
 
 def main(**kwargs):
@@ -67,18 +154,34 @@ def main(**kwargs):
     # read list of colors
     colors = args["--colors"].split(",")
     filename = args["<FILENAME>"]
+    max_rows = int(args["--max-rows"]) if args["--max-rows"] else None
+    # colorama strips the colors in a pipe, they aren't even generated
+    colored = sys.stdout.isatty()
+    if args["--width"]:
+        max_width = int(args["--width"])
+    else:
+        max_width = shutil.get_terminal_size().columns if colored else 0
 
     # consider - as a stdin
     if filename is None or filename == "-":
-        fp = sys.stdin
+        fp = io.TextIOWrapper(sys.stdin.buffer, encoding="utf8", newline="")
     else:
-        fp = smart_open.open(filename, "r", encoding="utf8")
-
-    # compute colorized version of tabulate
-    fmt = fs_tabulate(fp, color_list=colors)
-
-    # print
-    print(fmt)
+        fp = io.TextIOWrapper(open_stream(filename), encoding="utf8", newline="")
+
+    # print the lines in blocks as soon as they are rendered
+    lines = stream_table(csv.reader(fp), color_list=colors, sample=int(args["--sample"]), max_rows=max_rows,
+                         max_width=max_width, colored=colored)
+    try:
+        while True:
+            block = list(islice(lines, WRITE_ROWS))
+            if not block:
+                break
+            sys.stdout.write("\n".join(block) + "\n")
+            sys.stdout.flush()
+    except BrokenPipeError:
+        exit_on_broken_pipe()
+    finally:
+        fp.close()
 
 
 if __name__ == '__main__':
@@ -1,19 +1,41 @@
 """execute a tail command for a given cloud file (actually any cloud file) or local file
 
 Usage:
-  pytail [-n LINES] <FILENAME>
+  pytail [-n LINES] [--headers] [<FILENAME>...]
+  pytail [-n LINES] -f [--interval=S] [--max-interval=S] <FILENAME>
 
 Options:
     -n LINES                set the limit of tail-lines to be processed [default: 10], should be a positive value.
-    <FILENAME>              input filename to be processed (local or cloud)
+    -f, --follow            output appended data as the file grows (it survives truncation and rotation)
+    --interval=S            seconds between polls when following cloud files (or without inotify) [default: 1.0]
+    --max-interval=S        the poll interval doubles while nothing changes up to S seconds [default: 30.0]
+    --headers               print a `==> FILENAME <==` header before every file
+    <FILENAME>              input filenames to be processed (local or cloud), stdin if omitted,
+                            local globs and cloud patterns or prefixes (s3://bucket/prefix/) are expanded
+
+Seekable files (local, s3, gs, http with byte ranges) are read backwards from the end,
+so only the last blocks are fetched (only the last frames of zstd seekable and local bgzf files);
+stdin, gzip, bz2 and xz files are streamed.
 """
+import os
 import sys
-from typing import Dict, List, Type, IO
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Type, IO
 
-import smart_open
 from docopt import docopt
 from tqdm import tqdm
 
+from utils.inputs import expand_inputs, open_stream
+from utils.output import BlockWriter
+from utils.rangeio import RangeReader, LocalRangeReader, NotSeekableError, open_range_reader, is_stdin
+from utils.watch import Backoff, watch_file
+
+# first block read from the end of the file, every new block doubles it up to MAX_BLOCK_SIZE
+BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+# chunk size used to stream non seekable sources
+CHUNK_SIZE = 1024 * 1024
+
 
 def str2num(text: str, default=None, class_type: Type = int):
     val = default
@@ -26,29 +48,190 @@ def str2num(text: str, default=None, class_type: Type = int):
     return val
 
 
-def tail(fp: IO, n: int = 10):
-    """prints the tail-lines (default 10) of the given file `filename`
+def tail(fp: IO, n: int = 10, chunk_size: int = CHUNK_SIZE) -> List[bytes]:
+    """returns the tail-lines (default 10) of a binary stream that can't be seeked (stdin, compressed files)
 
-    :param filename: the local or cloud file
-    :type filename: str
-    :param n: the number of lines to be printed (default=10)
+    the stream is read in raw chunks and only the last `n` lines are kept in a bounded deque,
+    so every line costs O(1) no matter how big `n` is and nothing is decoded here
+
+    :param fp: the binary stream
+    :type fp: IO
+    :param n: the number of lines to be returned (default=10)
     :type n: int
-    :return: nothing
+    :param chunk_size: the number of bytes read at once
+    :type chunk_size: int
+    :return: the last lines without the line terminator
+    :rtype: List[bytes]
+    """
+    # use a ring buffer to save the last `n` lines
+    lines = deque(maxlen=n)
+    # the incomplete line at the end of the previous chunk
+    partial = b""
+    with tqdm(desc="reading...", unit="B", unit_scale=True, leave=False) as progress:
+        # A. read the file chunk by chunk
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            progress.update(len(chunk))
+            chunk_lines = (partial + chunk).split(b"\n")
+            partial = chunk_lines.pop()
+            lines.extend(chunk_lines)
+    # B. a last line without terminator is still a line
+    if partial:
+        lines.append(partial)
+    return list(lines)
+
+
+def tail_seek(reader: RangeReader, n: int = 10, block_size: int = BLOCK_SIZE) -> List[bytes]:
+    """returns the last `n` lines of a seekable file reading blocks backwards from the end
+
+    the file is never read past the block containing the first of the `n` lines,
+    blocks grow geometrically to keep the number of (remote) requests logarithmic
+
+    :param reader: the ranged reader of the file
+    :type reader: RangeReader
+    :param n: the number of lines to be returned (default=10)
+    :type n: int
+    :param block_size: the size of the first block to be read
+    :type block_size: int
+    :return: the last lines without the line terminator
+    :rtype: List[bytes]
+    """
+    position = reader.size
+    blocks = []
+    newlines = 0
+    # A. read backwards until n+1 line terminators are found (the first one closes a line we don't need)
+    while position > 0 and newlines <= n:
+        start = max(0, position - block_size)
+        block = reader.read(start, position - start)
+        blocks.append(block)
+        newlines += block.count(b"\n")
+        position = start
+        block_size = min(2 * block_size, MAX_BLOCK_SIZE)
+
+    # B. split the lines, a trailing terminator doesn't start a new line
+    data = b"".join(reversed(blocks))
+    if not data:
+        # an empty file has no lines (not a single empty one)
+        return []
+    lines = data.split(b"\n")
+    if data.endswith(b"\n"):
+        lines.pop()
+    return lines[-n:]
+
+
+def _copy_local(fd: int, position: int, size: int, writer: BlockWriter) -> int:
+    """writes the bytes [position, size) of the file descriptor and returns the new position"""
+    while position < size:
+        data = os.pread(fd, min(CHUNK_SIZE, size - position), position)
+        if not data:
+            break
+        writer.write(data)
+        position += len(data)
+    writer.flush()
+    return position
+
+
+def follow_local(path: str, position: int, interval: float = 1.0, max_interval: float = 30.0):
+    """writes forever the data appended to a local file after `position`
+
+    the process sleeps on inotify (or a stat backoff) between writes,
+    a truncated file is read again from the start and a rotated file
+    (another inode in the same path) is reopened once the old one is drained
+
+    :param path: the local file
+    :type path: str
+    :param position: the offset already printed
+    :type position: int
+    :param interval: the minimum seconds between polls (only without inotify)
+    :type interval: float
+    :param max_interval: the maximum seconds between checks
+    :type max_interval: float
+    :return: nothing, it ends with KeyboardInterrupt
     :rtype: None
     """
-    # use a buffer to save the last `n` lines
-    lines = []
-    # A. read the file line by line
-    for line in tqdm(fp, desc="reading...", leave=False):
-        # A.1 delete the first element to maintain only the last `n` lines
-        if len(lines) == n:
-            del lines[0]
-        # A.2 add the last processed line
-        lines.append(line)
-    # B. print the output
-    for line in lines:
-        end = "" if str(line).endswith("\n") else "\n"
-        print(line, end=end)
+    writer = BlockWriter()
+    watcher = watch_file(path, interval=interval, max_interval=max_interval)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        while True:
+            # A. write everything appended since the last time
+            size = os.fstat(fd).st_size
+            if size < position:
+                print(f"pytail: '{path}': file truncated", file=sys.stderr)
+                position = 0
+            position = _copy_local(fd, position, size, writer)
+
+            # B. another file in the same path means the file was rotated
+            try:
+                rotated = os.stat(path).st_ino != os.fstat(fd).st_ino
+            except FileNotFoundError:
+                rotated = False
+            if rotated:
+                _copy_local(fd, position, os.fstat(fd).st_size, writer)
+                os.close(fd)
+                fd = os.open(path, os.O_RDONLY)
+                position = 0
+                print(f"pytail: '{path}' has been replaced; following new file", file=sys.stderr)
+                continue
+
+            # C. sleep until the kernel (or the stat backoff) reports a change
+            watcher.wait(timeout=max_interval)
+    finally:
+        os.close(fd)
+        watcher.close()
+
+
+def follow_remote(reader: RangeReader, position: int, interval: float = 1.0, max_interval: float = 30.0):
+    """writes forever the data appended to a cloud file after `position`
+
+    the object size is polled with an exponential backoff between `interval` and
+    `max_interval` seconds and only the new byte range is fetched,
+    a smaller object means it was truncated or replaced and it is read again from the start
+
+    :param reader: the ranged reader of the file
+    :type reader: RangeReader
+    :param position: the offset already printed
+    :type position: int
+    :param interval: the minimum seconds between polls
+    :type interval: float
+    :param max_interval: the maximum seconds between polls
+    :type max_interval: float
+    :return: nothing, it ends with KeyboardInterrupt
+    :rtype: None
+    """
+    writer = BlockWriter()
+    backoff = Backoff(interval, max_interval)
+    while True:
+        size = reader.refresh()
+        if size < position:
+            print(f"pytail: '{reader.filename}': file truncated", file=sys.stderr)
+            position = 0
+        if size > position:
+            while position < size:
+                data = reader.read(position, min(CHUNK_SIZE, size - position))
+                writer.write(data)
+                position += len(data)
+            writer.flush()
+            backoff.reset()
+        backoff.sleep()
+
+
+def tail_file(filename: Optional[str], n: int = 10) -> Tuple[List[bytes], Optional[RangeReader]]:
+    """returns the last `n` lines of a file (stdin if None) and its ranged reader (None if it's not seekable)
+
+    the caller must close the reader, it is kept open to follow the file
+    """
+    if is_stdin(filename):
+        return tail(sys.stdin.buffer, n), None
+    reader = None
+    try:
+        reader = open_range_reader(filename)
+        return tail_seek(reader, n), reader
+    except NotSeekableError:
+        if reader is not None:
+            reader.close()
+        # fallback: stream the whole file
+        with open_stream(filename) as fp:
+            return tail(fp, n), None
 
 
 def main(**kwargs: Dict or List):
@@ -61,14 +244,40 @@ def main(**kwargs: Dict or List):
     """
     arguments = docopt(doc=__doc__, **kwargs)
 
-    arg_filename = arguments["<FILENAME>"]
+    arg_filenames = arguments["<FILENAME>"]
+    arg_filenames = expand_inputs(arg_filenames if isinstance(arg_filenames, list) else [arg_filenames])
     arg_n = arguments["-n"]
     n = str2num(arg_n, default=None, class_type=int)
     if n is None or n < 1:
         raise ValueError("-n N must be an integer number greater than 0")
+    if arguments["--follow"] and len(arg_filenames) != 1:
+        raise ValueError("-f/--follow needs exactly one file")
+
+    interval = float(arguments["--interval"])
+    max_interval = float(arguments["--max-interval"])
+
+    reader = None
+    with BlockWriter() as writer:
+        for k, filename in enumerate(arg_filenames):
+            lines, reader = tail_file(filename, n)
+            if arguments["--headers"]:
+                writer.write_header(filename, first=k == 0)
+            for line in lines:
+                writer.write_line(line)
+            if reader is not None and not arguments["--follow"]:
+                reader.close()
 
-    fp = smart_open.smart_open(arg_filename, "r") if arg_filename is not None else sys.stdin
-    tail(fp, n)
+    # stdin and non seekable sources are printed once, there is nothing to follow
+    if reader is None or not arguments["--follow"]:
+        return
+    with reader:
+        try:
+            if isinstance(reader, LocalRangeReader):
+                follow_local(reader.path, reader.size, interval=interval, max_interval=max_interval)
+            else:
+                follow_remote(reader, reader.size, interval=interval, max_interval=max_interval)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == '__main__':
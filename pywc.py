@@ -1,11 +1,12 @@
 """execute the wc command for a cloud file (actually any cloud file) or local file
 
 Usage:
-  pywc [--jsonl] [-L|-c|-l|-w]
-  pywc [--jsonl] [-L|-c|-l|-w] <FILENAME>
+  pywc [--jsonl] [-L] [-c] [-l] [-w] [--jobs=N] [--prefetch=K] [--no-total] [<FILENAME>...]
 
 Arguments:
-    <FILENAME>              input filename to be processed (local, cloud)
+    <FILENAME>              input filenames to be processed (local, cloud), stdin if omitted,
+                            local globs (data/part-*.jsonl) and cloud patterns or prefixes
+                            (s3://bucket/prefix/part-*.jsonl.gz, gs://bucket/prefix/) are expanded
 
 Options:
     -L              write the longest length of the lines
@@ -13,80 +14,252 @@ Options:
     -l              write the total number of lines
     -w              write the total number of words
     -j,--jsonl      read jsonl file, i.e. avoid empty lines
+    --jobs=N        split every seekable file (local or cloud) in byte ranges counted by N processes [default: 1]
+    --prefetch=K    download the next K cloud files while the current one is counted [default: 4]
+    --no-total      don't print the total row
+
+Any combination of counters is computed in a single pass over every file and
+printed like coreutils wc (lines, words, bytes, longest line), with the filename
+and a total row when more than one file is given.
 """
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-import smart_open
 from docopt import docopt
-from typing import Optional, IO
+from typing import Dict, IO, List, Optional
+
+from utils.inputs import expand_inputs, open_stream, prefetch_inputs
+from utils.rangeio import NotSeekableError, line_start, open_range_reader, is_stdin
+
+# the counters in the order they are printed (same as coreutils wc)
+COUNTERS = ("lines", "words", "bytes", "longest")
+WORD_REGEX = re.compile(r"\b\w+\b")
+# a whitespace-only line (skipped with --jsonl), the newline is excluded from the class to match a single line
+BLANK_LINE_REGEX = re.compile(rb"^[ \t\r\x0b\x0c]*\n", re.MULTILINE)
+# bytes read at once
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class WcCounter:
+    """accumulates the wc counters over chunks of raw bytes
+
+    lines and bytes are counted over the raw chunks (bytes.count), only -w and -L decode
+    the text, chunks are cut at the last newline so a line is never split between two updates
+    unless the line-aware path isn't needed at all (-l and -c without --jsonl)
+    """
+
+    def __init__(self, counters: List[str] = COUNTERS, is_jsonl: bool = False):
+        self.counters = counters
+        self.is_jsonl = is_jsonl
+        self.count_words = "words" in counters
+        self.count_longest = "longest" in counters
+        self.line_aware = is_jsonl or self.count_words or self.count_longest
+        self.values = {"lines": 0, "words": 0, "bytes": 0, "longest": 0}
+        # the incomplete line at the end of the last chunk (line aware path)
+        self.partial = b""
+        # the last byte seen (fast path), a last line without newline is still a line
+        self.last_byte = b"\n"
+
+    def update(self, chunk: bytes):
+        """count a new chunk of bytes"""
+        if not chunk:
+            return
+        if not self.line_aware:
+            self.values["lines"] += chunk.count(b"\n")
+            self.values["bytes"] += len(chunk)
+            self.last_byte = chunk[-1:]
+            return
+        data = self.partial + chunk
+        cut = data.rfind(b"\n") + 1
+        self.partial = data[cut:]
+        if cut:
+            self._count_lines(data[:cut])
+
+    def finish(self) -> Dict[str, int]:
+        """count the last line (if it has no newline) and return the requested counters"""
+        if not self.line_aware:
+            if self.last_byte != b"\n":
+                self.values["lines"] += 1
+        elif self.partial:
+            line, self.partial = self.partial, b""
+            # avoid empty lines only if a jsonl flag is active
+            if not (self.is_jsonl and not line.strip()):
+                self._count_lines(line + b"\n")
+                self.values["bytes"] -= 1
+        return {name: self.values[name] for name in self.counters}
+
+    def _count_lines(self, block: bytes):
+        """count a block of complete lines (it ends with a newline)"""
+        lines = block.count(b"\n")
+        size = len(block)
+        if self.is_jsonl:
+            blank_lines = BLANK_LINE_REGEX.findall(block)
+            lines -= len(blank_lines)
+            size -= sum(len(x) for x in blank_lines)
+        self.values["lines"] += lines
+        self.values["bytes"] += size
+        if not (self.count_words or self.count_longest):
+            return
+        text = block.decode("utf8", errors="replace")
+        if self.count_words:
+            self.values["words"] += len(WORD_REGEX.findall(text))
+        if self.count_longest:
+            text_lines = text.replace("\r\n", "\n").split("\n")[:-1]
+            if self.is_jsonl:
+                text_lines = [x for x in text_lines if x.strip()]
+            self.values["longest"] = max(self.values["longest"], max(map(len, text_lines), default=0))
+
+
+def wc(fp: IO, counters: List[str] = COUNTERS, is_jsonl: bool = False, chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """computes the requested counters in a single pass over the binary stream `fp`
+
+    :param fp: the input file pointer (binary mode)
+    :type fp: IO
+    :param counters: any subset of COUNTERS
+    :type counters: List[str]
+    :param is_jsonl: avoid empty lines
+    :type is_jsonl: bool
+    :param chunk_size: the number of bytes read at once
+    :type chunk_size: int
+    :return: the value of every requested counter
+    :rtype: Dict[str, int]
+    """
+    counter = WcCounter(counters, is_jsonl=is_jsonl)
+    for chunk in iter(lambda: fp.read(chunk_size), b""):
+        counter.update(chunk)
+    return counter.finish()
+
+
+def merge_counts(parts: List[Dict[str, int]]) -> Dict[str, int]:
+    """merge the counters of several files or byte ranges (sums, except the longest line)"""
+    total = {}
+    for part in parts:
+        for name, value in part.items():
+            total[name] = max(total.get(name, 0), value) if name == "longest" else total.get(name, 0) + value
+    return total
+
 
+def wc_range(filename: str, start: int, end: int, counters: List[str] = COUNTERS, is_jsonl: bool = False) -> Dict[str, int]:
+    """computes the counters of the lines starting inside the byte range [start, end) of a file
 
-def wc_longest_line(fp: IO, is_jsonl: bool = False) -> str:
+    a line crossing `end` is counted here up to its newline and skipped by the next range,
+    so words and line lengths are never split between two ranges
+    """
+    counter = WcCounter(counters, is_jsonl=is_jsonl)
+    with open_range_reader(filename) as reader:
+        position, last = line_start(reader, start), line_start(reader, end)
+        while position < last:
+            chunk = reader.read(position, min(CHUNK_SIZE, last - position))
+            counter.update(chunk)
+            position += len(chunk)
+    return counter.finish()
+
+
+def wc_parallel(filename: str, counters: List[str] = COUNTERS, is_jsonl: bool = False, jobs: int = 1) -> Dict[str, int]:
+    """computes the counters of a seekable file with `jobs` processes reading separate byte ranges
+
+    cloud files are read with concurrent ranged GETs, local files with concurrent preads
+    """
+    with open_range_reader(filename) as reader:
+        size = reader.size
+    # don't split below one chunk per process
+    splits = max(1, min(jobs, -(-size // CHUNK_SIZE)))
+    if splits == 1:
+        return wc_range(filename, 0, size, counters, is_jsonl=is_jsonl)
+    bounds = [size * k // splits for k in range(splits + 1)]
+    with ProcessPoolExecutor(max_workers=splits) as pool:
+        parts = list(pool.map(wc_range, repeat(filename), bounds[:-1], bounds[1:], repeat(counters), repeat(is_jsonl)))
+    return merge_counts(parts)
+
+
+def wc_file(filename: Optional[str], counters: List[str] = COUNTERS, is_jsonl: bool = False, jobs: int = 1) -> Dict[str, int]:
+    """computes the requested counters of a local or cloud file (stdin if None)
+
+    the byte count alone comes from the file metadata (os.stat, HEAD request) without reading it,
+    with jobs > 1 seekable files are split in byte ranges counted in parallel
+    """
+    if is_stdin(filename):
+        return wc(sys.stdin.buffer, counters, is_jsonl=is_jsonl)
+    if (list(counters) == ["bytes"] and not is_jsonl) or jobs > 1:
+        try:
+            with open_range_reader(filename) as reader:
+                if list(counters) == ["bytes"] and not is_jsonl:
+                    return {"bytes": reader.size}
+            return wc_parallel(filename, counters, is_jsonl=is_jsonl, jobs=jobs)
+        except NotSeekableError:
+            pass
+    with open_stream(filename) as fp:
+        return wc(fp, counters, is_jsonl=is_jsonl)
+
+
+def wc_longest_line(fp: IO, is_jsonl: bool = False) -> int:
     """WC operation of given filename"""
-    max_length = 0
-    for line_k in fp:
-        # avoid empty lines only if a jsonl flag is active
-        if is_jsonl and not line_k.strip():
-            continue
-        length = len(line_k) - (1 if line_k.endswith("\n") else 0)
-        max_length = max(max_length, length)
-    return max_length
+    return wc(fp, ["longest"], is_jsonl=is_jsonl)["longest"]
 
 
-def wc_total_bytes(fp: IO, is_jsonl: bool = False):
+def wc_total_bytes(fp: IO, is_jsonl: bool = False) -> int:
     """WC operation of given filename"""
-    total = 0
-    for line_k in fp:
-        # avoid empty lines only if a jsonl flag is active
-        if is_jsonl and not line_k.strip():
-            continue
-        total += len(line_k)
-    return total
+    return wc(fp, ["bytes"], is_jsonl=is_jsonl)["bytes"]
 
 
-def wc_total_lines(fp: IO, is_jsonl: bool = False):
+def wc_total_lines(fp: IO, is_jsonl: bool = False) -> int:
     """WC operation of given filename"""
-    total = 0
-    for line_k in fp:
-        # avoid empty lines only if a jsonl flag is active
-        if is_jsonl and not line_k.strip():
-            continue
-        total += 1
-    return total
+    return wc(fp, ["lines"], is_jsonl=is_jsonl)["lines"]
 
 
-def wc_total_words(fp: IO, is_jsonl: bool = False):
+def wc_total_words(fp: IO, is_jsonl: bool = False) -> int:
     """WC operation of given filename"""
-    regex = re.compile(r"\b\w+\b")
-    total = 0
-    for line_k in fp:
-        # avoid empty lines only if a jsonl flag is active
-        if is_jsonl and not line_k.strip():
-            continue
-        response = regex.findall(line_k)
-        total += len(response)
-    return total
+    return wc(fp, ["words"], is_jsonl=is_jsonl)["words"]
+
+
+def format_rows(rows: List[Dict[str, int]], names: List[Optional[str]]) -> List[str]:
+    """formats the rows of counters like coreutils wc, right aligned to a common width
+
+    :param rows: the counters of every row
+    :type rows: List[Dict[str, int]]
+    :param names: the name printed after the counters of every row (None to omit it)
+    :type names: List[Optional[str]]
+    :return: the formatted lines
+    :rtype: List[str]
+    """
+    values = [value for row in rows for value in row.values()]
+    width = max(len(str(value)) for value in values) if len(values) > 1 else 1
+    lines = []
+    for row, name in zip(rows, names):
+        line = " ".join(f"{value:>{width}}" for value in row.values())
+        lines.append(line if name is None else f"{line} {name}")
+    return lines
 
 
 def main(**kwargs):
     args = docopt(doc=__doc__, **kwargs)
 
-    fp = smart_open.smart_open(args['<FILENAME>'], 'r') if args['<FILENAME>'] is not None else sys.stdin
+    flags = {"lines": args["-l"], "words": args["-w"], "bytes": args["-c"], "longest": args["-L"]}
+    # default option
+    counters = [name for name in COUNTERS if flags[name]] or ["bytes"]
 
-    if args["-L"]:
-        response = wc_longest_line(fp, is_jsonl=args["--jsonl"])
-    elif args["-c"]:
-        response = wc_total_bytes(fp, is_jsonl=args["--jsonl"])
-    elif args["-l"]:
-        response = wc_total_lines(fp, is_jsonl=args["--jsonl"])
-    elif args["-w"]:
-        response = wc_total_words(fp, is_jsonl=args["--jsonl"])
+    jobs = int(args["--jobs"])
+    if jobs < 1:
+        raise ValueError("--jobs N must be an integer number greater than 0")
+
+    filenames = expand_inputs(args["<FILENAME>"])
+    is_jsonl = args["--jsonl"]
+    if jobs > 1 or (counters == ["bytes"] and not is_jsonl):
+        # ranged reads or metadata only, there is nothing to prefetch
+        rows = [wc_file(filename, counters, is_jsonl=is_jsonl, jobs=jobs) for filename in filenames]
     else:
-        # default option
-        response = wc_total_bytes(fp, is_jsonl=args["--jsonl"])
+        inputs = prefetch_inputs(filenames, prefetch=int(args["--prefetch"]))
+        rows = [wc(fp, counters, is_jsonl=is_jsonl) for _, fp in inputs]
+
+    names = filenames if len(filenames) > 1 else [None]
+    if len(rows) > 1 and not args["--no-total"]:
+        rows.append(merge_counts(rows))
+        names = names + ["total"]
 
-    print(response)
+    for line in format_rows(rows, names):
+        print(line)
 
 
 if __name__ == '__main__':
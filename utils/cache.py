@@ -0,0 +1,12 @@
+"""The cache directory of the tools: `~/.cache/<name>` ($XDG_CACHE_HOME is honored)
+
+    Example:
+        folder = cache_dir("pycat")
+"""
+import os
+
+
+def cache_dir(name: str) -> str:
+    """the cache directory of the tool `name`"""
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, name)
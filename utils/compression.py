@@ -0,0 +1,432 @@
+"""Transparent decompression for the file tools, in parallel blocks when the format allows it
+
+    The codec is detected by the magic bytes of the data, not by the extension:
+        gzip    1f 8b                   sequential (zlib), concatenated members are supported
+        bgzf    1f 8b + `BC` extra      every member (block) stores its size, so the blocks of a
+                                        stream are decompressed in parallel threads
+        bz2     42 5a 68 (BZh)          sequential, concatenated streams are supported
+        xz      fd 37 7a 58 5a 00       sequential, concatenated streams are supported
+        zstd    28 b5 2f fd             sequential, or parallel frames when the file has a seek table
+                                        (zstd seekable format)
+
+    Seekable formats (zstd with a seek table, local bgzf files) are exposed as a
+    DecompressedRangeReader: a RangeReader over the decompressed bytes, so pytail, pyhead,
+    pywc --jobs and pycat --index fetch and decompress only the frames they need.
+    The blocks of a bgzf file are scanned once and kept in ~/.cache/pycat (the .gzi format of bgzip -i).
+
+    zlib, bz2, lzma and zstandard release the GIL while they decompress, so threads are enough.
+
+    Example:
+        with open_decompressed(smart_open.open("s3://bucket/part-0001.jsonl.gz", "rb", compression="disable")) as fp:
+            for line in fp:
+                ...
+"""
+import bz2
+import hashlib
+import io
+import itertools
+import lzma
+import os
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, IO, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from utils.cache import cache_dir
+from utils.parallel import ordered_map
+from utils.rangeio import RangeReader, LocalRangeReader, NotSeekableError
+
+GZIP_MAGIC = b"\x1f\x8b"
+BZ2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# bytes needed to tell a bgzf block from a gzip member
+MAGIC_SIZE = 18
+
+# bgzf block header: gzip header with FEXTRA, the `BC` subfield holds the block size - 1
+BGZF_HEADER = struct.Struct("<4sIBBHBBHH")
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+# zstd seekable format: skippable frame with the seek table, the footer ends the file
+SEEK_TABLE_FOOTER = struct.Struct("<IBI")
+SEEKABLE_MAGIC = 0x8F92EAB1
+# bgzip index (.gzi): the number of entries and the (compressed, decompressed) offsets of the blocks after the first
+GZI_COUNT = struct.Struct("<Q")
+GZI_ENTRY = struct.Struct("<QQ")
+GZI_EXTENSION = ".gzi"
+
+# compressed bytes read at once by the streams
+CHUNK_SIZE = 8 * 1024 * 1024
+# compressed bytes decompressed by every task of the parallel bgzf stream
+GROUP_SIZE = 1024 * 1024
+# threads used to decompress blocks and frames
+THREADS = os.cpu_count() or 1
+
+_pools = {}
+
+
+def _pool(threads: int) -> ThreadPoolExecutor:
+    """a shared thread pool for every number of threads"""
+    if threads not in _pools:
+        _pools[threads] = ThreadPoolExecutor(max_workers=threads)
+    return _pools[threads]
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ImportError("the zstandard package is needed to read zstd files: pip install zstandard")
+    return zstandard
+
+
+def detect_codec(head: bytes) -> Optional[str]:
+    """the codec of the data starting with `head` (gzip, bgzf, bz2, xz, zstd) or None"""
+    if head.startswith(BGZF_MAGIC) and len(head) >= MAGIC_SIZE and head[12:14] == b"BC":
+        return "bgzf"
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(BZ2_MAGIC):
+        return "bz2"
+    if head.startswith(XZ_MAGIC):
+        return "xz"
+    if head.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+class ChunksStream(io.RawIOBase):
+    """a readable raw stream over an iterator of bytes chunks, wrap it with io.BufferedReader"""
+
+    def __init__(self, chunks: Iterator[bytes], on_close: Optional[Callable] = None):
+        self.chunks = chunks
+        self.on_close = on_close
+        self.chunk = b""
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.position >= len(self.chunk):
+            self.chunk = next(self.chunks, None)
+            self.position = 0
+            if self.chunk is None:
+                self.chunk = b""
+                return 0
+        size = min(len(buffer), len(self.chunk) - self.position)
+        buffer[:size] = self.chunk[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        if not self.closed and self.on_close is not None:
+            self.on_close()
+        super().close()
+
+
+def _decompressor_factory(codec: str) -> Callable:
+    """a function returning a new incremental decompressor of the codec"""
+    if codec in ("gzip", "bgzf"):
+        return lambda: zlib.decompressobj(31)
+    if codec == "bz2":
+        return bz2.BZ2Decompressor
+    if codec == "xz":
+        return lzma.LZMADecompressor
+    if codec == "zstd":
+        return _require_zstd().ZstdDecompressor().decompressobj
+    raise ValueError(f"unknown codec '{codec}'")
+
+
+def iter_sequential(fp: IO, codec: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """decompress a stream chunk by chunk, a new decompressor starts after every member/stream/frame"""
+    new_decompressor = _decompressor_factory(codec)
+    decompressor = new_decompressor()
+    for data in iter(lambda: fp.read(chunk_size), b""):
+        while data:
+            output = decompressor.decompress(data)
+            if output:
+                yield output
+            if not decompressor.eof:
+                break
+            data = decompressor.unused_data
+            decompressor = new_decompressor()
+
+
+def _bgzf_block_size(data: bytes, offset: int) -> int:
+    """the total size of the bgzf block starting at `offset`"""
+    magic, _, _, _, _, si1, si2, _, bsize = BGZF_HEADER.unpack_from(data, offset)
+    if magic != BGZF_MAGIC or (si1, si2) != (ord("B"), ord("C")):
+        raise ValueError(f"invalid bgzf block at offset {offset}")
+    return bsize + 1
+
+
+def _bgzf_groups(fp: IO, group_size: int = GROUP_SIZE) -> Iterator[List[bytes]]:
+    """split a bgzf stream in groups of complete blocks of about `group_size` compressed bytes"""
+    data = b""
+    while True:
+        chunk = fp.read(group_size)
+        data = data + chunk if data else chunk
+        blocks = []
+        offset = 0
+        while offset + BGZF_HEADER.size <= len(data):
+            size = _bgzf_block_size(data, offset)
+            if offset + size > len(data):
+                break
+            blocks.append(data[offset:offset + size])
+            offset += size
+        data = data[offset:]
+        if blocks:
+            yield blocks
+        if not chunk:
+            if data:
+                raise ValueError("truncated bgzf stream")
+            return
+
+
+def _decompress_bgzf_group(blocks: List[bytes]) -> bytes:
+    return b"".join(zlib.decompress(x, 31) for x in blocks)
+
+
+def _decompress_frame(codec: str, frame: bytes, size: int) -> bytes:
+    if codec == "bgzf":
+        return zlib.decompress(frame, 31)
+    return _require_zstd().ZstdDecompressor().decompress(frame, max_output_size=size)
+
+
+def parallel_map(fn: Callable, items: Iterator, threads: int = THREADS) -> Iterator:
+    """like map but `threads` items are processed at once, the results keep the order of the items"""
+    return ordered_map(_pool(threads), fn, ((item,) for item in items), window=2 * threads)
+
+
+def peek(fp: IO, size: int = MAGIC_SIZE) -> Tuple[bytes, IO]:
+    """the first `size` bytes of a stream and a stream that still starts with them"""
+    if hasattr(fp, "peek"):
+        head = fp.peek(size)[:size]
+        if len(head) >= size or not head:
+            return head, fp
+    head = fp.read(size)
+    if fp.seekable():
+        fp.seek(0)
+        return head, fp
+    # not seekable: put the head back in front of the rest of the stream
+    chunks = itertools.chain([head], iter(lambda: fp.read(CHUNK_SIZE), b""))
+    return head, io.BufferedReader(ChunksStream(chunks, on_close=fp.close), CHUNK_SIZE)
+
+
+def open_decompressed(fp: IO, threads: int = THREADS) -> IO:
+    """wrap a binary stream with the decompressor of its codec (the stream itself if it isn't compressed)
+
+    :param fp: the raw binary stream
+    :type fp: IO
+    :param threads: the threads decompressing bgzf blocks
+    :type threads: int
+    :return: a binary stream of decompressed bytes (closing it closes `fp`)
+    :rtype: IO
+    """
+    head, fp = peek(fp)
+    codec = detect_codec(head)
+    if codec is None:
+        return fp
+    if codec == "bgzf" and threads > 1:
+        chunks = parallel_map(_decompress_bgzf_group, _bgzf_groups(fp), threads=threads)
+    else:
+        chunks = iter_sequential(fp, codec)
+    return io.BufferedReader(ChunksStream(chunks, on_close=fp.close), CHUNK_SIZE)
+
+
+class FrameIndex:
+    """the compressed and decompressed offsets and sizes of the independent frames of a file"""
+
+    def __init__(self, codec: str):
+        self.codec = codec
+        self.compressed_offsets: List[int] = []
+        self.compressed_sizes: List[int] = []
+        self.offsets: List[int] = []
+        self.sizes: List[int] = []
+        self.size = 0
+
+    def add(self, compressed_offset: int, compressed_size: int, size: int):
+        """add the next frame"""
+        if size == 0:
+            return
+        self.compressed_offsets.append(compressed_offset)
+        self.compressed_sizes.append(compressed_size)
+        self.offsets.append(self.size)
+        self.sizes.append(size)
+        self.size += size
+
+
+def zstd_frame_index(reader: RangeReader) -> Optional[FrameIndex]:
+    """the frames of a zstd file from its seek table (None if it doesn't have one)"""
+    if reader.size < SEEK_TABLE_FOOTER.size:
+        return None
+    frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(reader.read(reader.size - SEEK_TABLE_FOOTER.size, SEEK_TABLE_FOOTER.size))
+    if magic != SEEKABLE_MAGIC:
+        return None
+    entry_size = 12 if descriptor & 0x80 else 8
+    table_size = frames * entry_size
+    table = reader.read(reader.size - SEEK_TABLE_FOOTER.size - table_size, table_size)
+    index = FrameIndex("zstd")
+    offset = 0
+    for k in range(frames):
+        compressed_size, size = struct.unpack_from("<II", table, k * entry_size)
+        index.add(offset, compressed_size, size)
+        offset += compressed_size
+    return index
+
+
+def _bgzf_blocks(reader: RangeReader, offset: int) -> Iterator[Tuple[int, int, int]]:
+    """the offset, size and decompressed size of the bgzf blocks from `offset` to the end, reading only their headers"""
+    while offset < reader.size:
+        size = _bgzf_block_size(reader.read(offset, BGZF_HEADER.size), 0)
+        # ISIZE: the last 4 bytes of the block
+        decompressed_size, = struct.unpack("<I", reader.read(offset + size - 4, 4))
+        yield offset, size, decompressed_size
+        offset += size
+
+
+def gzi_cache_path(path: str) -> str:
+    """the .gzi index of the file inside the cache directory"""
+    key = hashlib.sha1(os.path.abspath(path).encode("utf8")).hexdigest()
+    return os.path.join(cache_dir("pycat"), key + GZI_EXTENSION)
+
+
+def load_gzi(path: str, data_path: str) -> Optional[List[Tuple[int, int]]]:
+    """the (compressed, decompressed) offsets of the blocks in a .gzi index, the first block included
+
+    None if the index is missing, corrupted or older than the data
+    """
+    try:
+        if os.stat(path).st_mtime_ns < os.stat(data_path).st_mtime_ns:
+            return None
+        with open(path, "rb") as fp:
+            data = fp.read()
+        count, = GZI_COUNT.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    if len(data) != GZI_COUNT.size + count * GZI_ENTRY.size:
+        return None
+    return [(0, 0)] + list(GZI_ENTRY.iter_unpack(data[GZI_COUNT.size:]))
+
+
+def save_gzi(path: str, index: "FrameIndex"):
+    """write the blocks after the first one as a .gzi index (the format of bgzip -i) atomically"""
+    entries = list(zip(index.compressed_offsets[1:], index.offsets[1:]))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as fp:
+            fp.write(GZI_COUNT.pack(len(entries)))
+            fp.write(b"".join(GZI_ENTRY.pack(*x) for x in entries))
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def bgzf_frame_index(reader: RangeReader) -> Optional[FrameIndex]:
+    """the blocks of a local bgzf file (None for cloud files)
+
+    the blocks are read from the `<filename>.gzi` index of bgzip -i or from the copy in the cache
+    directory written by a previous call, only the blocks after its last entry are scanned (reading
+    their headers and sizes). Nothing is written next to the data: the copy in the cache is updated
+    when the scan found new blocks, the index is used without saving it if the cache isn't writable
+    """
+    if not isinstance(reader, LocalRangeReader):
+        return None
+    cache_path = gzi_cache_path(reader.path)
+    blocks = load_gzi(cache_path, reader.path) or load_gzi(reader.path + GZI_EXTENSION, reader.path)
+    if blocks is not None and blocks[-1][0] >= reader.size:
+        blocks = None
+    if blocks is not None:
+        index = FrameIndex("bgzf")
+        for (offset, decompressed_offset), (next_offset, next_decompressed_offset) in zip(blocks, blocks[1:]):
+            index.add(offset, next_offset - offset, next_decompressed_offset - decompressed_offset)
+        try:
+            tail = list(_bgzf_blocks(reader, blocks[-1][0]))
+        except (ValueError, struct.error):
+            # a stale index of a rewritten file
+            blocks = None
+    if blocks is None:
+        index = FrameIndex("bgzf")
+        tail = list(_bgzf_blocks(reader, 0))
+    for offset, size, decompressed_size in tail:
+        index.add(offset, size, decompressed_size)
+    # the last data block and the empty eof block are always scanned
+    if blocks is None or len(tail) > 2:
+        try:
+            save_gzi(cache_path, index)
+        except OSError:
+            pass
+    return index
+
+
+class DecompressedRangeReader(RangeReader):
+    """ranged reads over the decompressed bytes of a file with independent frames
+
+    a read fetches the compressed span of the frames it touches with a single ranged read
+    and decompresses them in parallel threads, the frames at both ends are cached
+    because consecutive reads usually share them
+    """
+
+    def __init__(self, raw: RangeReader, index: FrameIndex, threads: int = THREADS):
+        super().__init__(raw.filename)
+        self.raw = raw
+        self.index = index
+        self.threads = threads
+        self.cache = {}
+
+    def _fetch_size(self) -> int:
+        return self.index.size
+
+    def read(self, start: int, length: int) -> bytes:
+        if length <= 0 or start >= self.size:
+            return b""
+        end = min(self.size, start + length)
+        offsets = self.index.offsets
+        first, last = bisect_right(offsets, start) - 1, bisect_left(offsets, end) - 1
+
+        frames = {k: self.cache[k] for k in (first, last) if k in self.cache}
+        todo = [k for k in range(first, last + 1) if k not in frames]
+        if todo:
+            span_start = self.index.compressed_offsets[todo[0]]
+            span_end = self.index.compressed_offsets[todo[-1]] + self.index.compressed_sizes[todo[-1]]
+            span = self.raw.read(span_start, span_end - span_start)
+            items = []
+            for k in todo:
+                offset = self.index.compressed_offsets[k] - span_start
+                items.append((k, span[offset:offset + self.index.compressed_sizes[k]]))
+            decompress = lambda item: _decompress_frame(self.index.codec, item[1], self.index.sizes[item[0]])
+            frames.update(zip(todo, parallel_map(decompress, iter(items), threads=self.threads)))
+
+        self.cache = {first: frames[first], last: frames[last]}
+        self.bytes_read = self.raw.bytes_read
+        self.requests = self.raw.requests
+        data = b"".join(frames[k] for k in range(first, last + 1))
+        return data[start - offsets[first]:end - offsets[first]]
+
+    def close(self):
+        self.raw.close()
+
+
+def wrap_range_reader(reader: RangeReader, threads: int = THREADS) -> RangeReader:
+    """the reader itself for plain files, a DecompressedRangeReader for files with independent frames
+
+    compressed files without a frame index can't be read by ranges: NotSeekableError is raised
+    """
+    codec = detect_codec(reader.read(0, MAGIC_SIZE))
+    if codec is None:
+        return reader
+    index = None
+    if codec == "zstd" and zstandard is not None:
+        index = zstd_frame_index(reader)
+    elif codec == "bgzf":
+        index = bgzf_frame_index(reader)
+    if index is None:
+        reader.close()
+        raise NotSeekableError(f"'{reader.filename}' is {codec} compressed without a frame index")
+    return DecompressedRangeReader(reader, index, threads=threads)
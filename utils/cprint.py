@@ -13,9 +13,13 @@
         cprint_success      light green over black
         cprint_warning      light yellow over black
         cprint_error        light white over red
+
+    the ansi prefix of every (fg_color, bg_color, style) is computed once (style_prefix),
+    cformat_many formats a whole row or column with the same style in a single call
 """
 import sys
-from typing import Any, List
+from functools import lru_cache
+from typing import Any, Iterable, List
 from typing import IO
 
 from colorama import init, Fore, Back, Style
@@ -57,6 +61,25 @@ def fix_color_name(color: str) -> str:
     return color
 
 
+@lru_cache(maxsize=None)
+def style_prefix(fg_color: str = '', bg_color: str = '', style: str = '') -> str:
+    """the ansi prefix (bg+fg+st) of the given color names and style, memoized by (fg_color, bg_color, style)
+
+    :param fg_color: foreground color name (red, blue, cyan,...)
+    :type fg_color: str
+    :param bg_color: background color name
+    :type bg_color: str
+    :param style: style name (dim, normal, bright)
+    :type style: str
+    :return: the ansi escape codes
+    :rtype: str
+    """
+    fg = fg_color_map.get(fix_color_name(fg_color), "")
+    bg = bg_color_map.get(fix_color_name(bg_color), "")
+    st = style_map.get(style.upper(), "")
+    return bg + fg + st
+
+
 def cformat(*value: Any,
             fg_color: str = '',
             bg_color: str = '',
@@ -83,15 +106,12 @@ def cformat(*value: Any,
     :return: transformed values as a single string
     :rtype: str or List[str]
     """
-    #1. get real values for foreground, background and style
-    fg = fg_color_map.get(fix_color_name(fg_color), "")
-    bg = bg_color_map.get(fix_color_name(bg_color), "")
-    st = style_map.get(style.upper(), "")
+    #1. get real values for foreground, background and style (bg+fg+st)
+    prefix = style_prefix(fg_color, bg_color, style)
 
     #2. build a list of formatted arguments
-    # every value (converted to string) with prefixes
-    # for foreground, background and style (bg+fg+st)
-    args = list(bg + fg + st + str(v) for v in value)
+    # every value (converted to string) with the prefix
+    args = [prefix + str(v) for v in value]
 
     #3. if one value, return str
     if len(args) == 1:
@@ -100,6 +120,30 @@ def cformat(*value: Any,
     return args
 
 
+def cformat_many(values: Iterable[Any],
+                 fg_color: str = '',
+                 bg_color: str = '',
+                 style: str = '') -> List[str]:
+    """format a whole row or column with the same colors and style,
+    it is the same as [cformat(v, ...) for v in values] with a single style lookup
+    Example:
+        cells = cformat_many(df["price"], fg_color="cyan", style="normal")
+
+    :param values: sequence of values
+    :type values: Iterable[Any]
+    :param fg_color: foreground color name (red, blue, cyan,...)
+    :type fg_color: str
+    :param bg_color: background color name
+    :type bg_color: str
+    :param style: style name (dim, normal, bright)
+    :type style: str
+    :return: a formatted string for every value
+    :rtype: List[str]
+    """
+    prefix = style_prefix(fg_color, bg_color, style)
+    return [prefix + str(v) for v in values]
+
+
 def cprint(*value: Any,
            fg_color: str = '',
            bg_color: str = '',
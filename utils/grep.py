@@ -0,0 +1,133 @@
+"""Parallel regex search of the lines of large files
+
+    The file is split in chunks aligned to line boundaries that are searched by a pool
+    of processes with a compiled byte regex, the matching lines come back in file order:
+        seekable files  -> every process reads its own byte range (local preads, ranged GETs,
+                           decompressed frames of seekable formats)
+        other streams   -> the parent reads line aligned chunks (decompressed, stdin) and sends
+                           them to the pool
+
+    The regex runs over the whole chunk (re.MULTILINE), not line by line, so a chunk
+    without matches costs a single scan in C. The reported line is the one where the match starts.
+
+    Example:
+        for match in grep_file("big.jsonl", rb"status.:500", jobs=8):
+            print(match.line, match.offset, match.text)
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, IO, Iterator, List, NamedTuple, Optional, Tuple
+
+from utils.inputs import open_stream
+from utils.parallel import ordered_map
+from utils.rangeio import RangeReader, NotSeekableError, line_start, open_range_reader
+
+# bytes searched by a task
+RANGE_SIZE = 16 * 1024 * 1024
+JOBS = os.cpu_count() or 1
+
+# the readers opened by a worker process, reused by its next ranges
+_READERS: Dict[str, RangeReader] = {}
+
+
+class GrepMatch(NamedTuple):
+    """a matching line, its (1-based) line number and the byte offset where it starts"""
+    line: int
+    offset: int
+    text: bytes
+
+
+def grep_chunk(pattern: bytes, flags: int, chunk: bytes, offset: int = 0) -> Tuple[List[Tuple[int, int, bytes]], int]:
+    """search the lines of a chunk (it starts at the byte `offset` of the file)
+
+    :return: the matches as (newlines before the line, byte offset, line) and the newlines of the chunk
+    :rtype: Tuple[List[Tuple[int, int, bytes]], int]
+    """
+    # re keeps a cache of the compiled patterns
+    regex = re.compile(pattern, flags | re.MULTILINE)
+    matches = []
+    position, newlines, counted = 0, 0, 0
+    while position < len(chunk):
+        match = regex.search(chunk, position)
+        # `^$` matches after the last newline too: that position starts the next chunk, not a line of this one
+        if match is None or (match.start() >= len(chunk) and chunk.endswith(b"\n")):
+            break
+        begin = chunk.rfind(b"\n", position, match.start()) + 1 or position
+        end = chunk.find(b"\n", match.start())
+        end = len(chunk) if end < 0 else end + 1
+        newlines += chunk.count(b"\n", counted, begin)
+        counted = begin
+        matches.append((newlines, offset + begin, chunk[begin:end]))
+        position = end
+    return matches, chunk.count(b"\n")
+
+
+def grep_range(filename: str, start: int, end: int, pattern: bytes, flags: int = 0):
+    """search the lines starting inside the byte range [start, end) of a seekable file"""
+    reader = _READERS.get(filename)
+    if reader is None:
+        reader = _READERS[filename] = open_range_reader(filename)
+    position, last = line_start(reader, start), line_start(reader, end)
+    return grep_chunk(pattern, flags, reader.read(position, last - position), position)
+
+
+def _stream_chunks(fp: IO, chunk_size: int = RANGE_SIZE) -> Iterator[Tuple[bytes, int]]:
+    """line aligned chunks of a stream and their offsets"""
+    offset = 0
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            return
+        if not chunk.endswith(b"\n"):
+            chunk += fp.readline()
+        yield chunk, offset
+        offset += len(chunk)
+
+
+def grep_file(filename: str, pattern: bytes, flags: int = 0, jobs: int = JOBS, fp: Optional[IO] = None,
+              range_size: int = RANGE_SIZE) -> Iterator[GrepMatch]:
+    """yield the lines of a file matching the regex in file order
+
+    :param filename: the local or cloud file
+    :type filename: str
+    :param pattern: the byte regex
+    :type pattern: bytes
+    :param flags: re flags (re.IGNORECASE)
+    :type flags: int
+    :param jobs: the number of processes, 1 searches in this process
+    :type jobs: int
+    :param fp: a binary stream to read instead of the file (stdin)
+    :type fp: IO
+    :return: an iterator of GrepMatch
+    :rtype: Iterator[GrepMatch]
+    """
+    re.compile(pattern, flags)  # a wrong pattern fails here, not in a worker
+
+    stream = None
+    if fp is None:
+        try:
+            with open_range_reader(filename) as reader:
+                size = reader.size
+            bounds = list(range(0, size, range_size)) + [size]
+            tasks = ((filename, a, b, pattern, flags) for a, b in zip(bounds[:-1], bounds[1:]))
+            fn = grep_range
+        except NotSeekableError:
+            # gzip, bz2, xz files and servers without ranges: the chunks are read here
+            fp = stream = open_stream(filename)
+    if fp is not None:
+        tasks = ((pattern, flags, chunk, offset) for chunk, offset in _stream_chunks(fp, range_size))
+        fn = grep_chunk
+
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        lines = 0
+        for matches, newlines in ordered_map(pool, fn, tasks, window=2 * jobs):
+            for before, offset, text in matches:
+                yield GrepMatch(lines + before + 1, offset, text)
+            lines += newlines
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if stream is not None:
+            stream.close()
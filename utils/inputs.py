@@ -0,0 +1,182 @@
+"""Multi-file inputs: local globs, s3/gs prefixes and prefetched streams
+
+    expand_inputs turns the filenames given in the command line into the list of files to read:
+        data/part-*.jsonl.gz            -> local glob (sorted)
+        s3://bucket/prefix/*.jsonl.gz   -> paginated ListObjectsV2 filtered by the pattern (sorted)
+        gs://bucket/prefix/             -> every blob under the prefix (sorted)
+        -                               -> stdin
+
+    prefetch_inputs opens the files in order while the next K cloud objects are already
+    being downloaded by a thread pool (into spooled temporary files), so a shard is ready
+    when the previous one is done.
+
+    Compressed files are decompressed according to their magic bytes (see utils.compression).
+
+    Example:
+        for filename, fp in prefetch_inputs(expand_inputs(["s3://bucket/logs/part-*"]), prefetch=4):
+            ...
+"""
+import fnmatch
+import glob
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import smart_open
+
+from utils.compression import DecompressedRangeReader, detect_codec, open_decompressed, peek
+from utils.rangeio import NotSeekableError, RangeStream, open_range_reader, is_stdin, split_bucket_key
+
+# the characters that make a filename a pattern
+GLOB_REGEX = re.compile(r"[*?\[]")
+# a prefetched object is kept in memory up to this size, then it spills to a temporary file
+SPOOL_SIZE = 64 * 1024 * 1024
+COPY_SIZE = 8 * 1024 * 1024
+# bytes read at once from the ranged readers
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def is_cloud(filename: str) -> bool:
+    """True for s3:// and gs:// uris"""
+    return urlparse(filename).scheme.lower() in ("s3", "s3a", "s3n", "s3u", "gs")
+
+
+def _key_pattern(key: str) -> Tuple[str, str]:
+    """the listing prefix and the fnmatch pattern of a key, `prefix/` means every key under it"""
+    if not GLOB_REGEX.search(key):
+        return key, key + "*"
+    prefix = key[:GLOB_REGEX.search(key).start()]
+    return prefix, key
+
+
+def list_s3(uri: str) -> List[str]:
+    """every object matching the uri pattern (paginated listing)"""
+    import boto3
+
+    scheme = urlparse(uri).scheme
+    bucket, key = split_bucket_key(uri)
+    prefix, pattern = _key_pattern(key)
+    paginator = boto3.client("s3").get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(x["Key"] for x in page.get("Contents", []) if fnmatch.fnmatchcase(x["Key"], pattern))
+    return [f"{scheme}://{bucket}/{x}" for x in sorted(keys) if not x.endswith("/")]
+
+
+def list_gs(uri: str) -> List[str]:
+    """every blob matching the uri pattern (the iterator of the client paginates)"""
+    from google.cloud import storage
+
+    bucket, key = split_bucket_key(uri)
+    prefix, pattern = _key_pattern(key)
+    blobs = storage.Client().list_blobs(bucket, prefix=prefix)
+    keys = [x.name for x in blobs if fnmatch.fnmatchcase(x.name, pattern)]
+    return [f"gs://{bucket}/{x}" for x in sorted(keys) if not x.endswith("/")]
+
+
+def expand_inputs(filenames: List[str]) -> List[Optional[str]]:
+    """expand local globs and cloud patterns/prefixes, no filenames means stdin ([None])
+
+    :param filenames: the filenames, patterns or prefixes given by the user
+    :type filenames: List[str]
+    :return: the files to be read in order
+    :rtype: List[Optional[str]]
+    """
+    expanded = []
+    for filename in filenames or [None]:
+        if is_stdin(filename):
+            expanded.append(None)
+        elif is_cloud(filename) and (GLOB_REGEX.search(filename) or filename.endswith("/")):
+            expanded.extend(list_s3(filename) if filename.lower().startswith("s3") else list_gs(filename))
+        elif GLOB_REGEX.search(filename) and "://" not in filename:
+            # a pattern without matches is kept, so the error is reported when it is opened
+            expanded.extend(sorted(glob.glob(os.path.expanduser(filename), recursive=True)) or [filename])
+        else:
+            expanded.append(filename)
+    return expanded
+
+
+def open_stream(filename: str) -> IO:
+    """open a local or cloud file as a binary stream of its decompressed bytes
+
+    zstd files with a seek table are read by ranges to decompress their frames in parallel,
+    any other file is streamed through its decompressor
+    """
+    head, fp = peek(smart_open.open(filename, "rb", compression="disable"))
+    if detect_codec(head) == "zstd":
+        try:
+            reader = open_range_reader(filename)
+        except NotSeekableError:
+            pass
+        else:
+            if isinstance(reader, DecompressedRangeReader):
+                fp.close()
+                return io.BufferedReader(RangeStream(reader), CHUNK_SIZE)
+            reader.close()
+    return open_decompressed(fp)
+
+
+def _download(filename: str) -> IO:
+    """copy a cloud object into a spooled temporary file, the stream starts at its decompressed bytes"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with smart_open.open(filename, "rb", compression="disable") as fp:
+        shutil.copyfileobj(fp, spool, COPY_SIZE)
+    spool.seek(0)
+    return open_decompressed(spool)
+
+
+def _open(filename: Optional[str], download: bool = True) -> IO:
+    """open the input in binary mode, cloud objects are downloaded (or streamed)"""
+    if is_stdin(filename):
+        return sys.stdin.buffer
+    if download and is_cloud(filename):
+        return _download(filename)
+    return open_stream(filename)
+
+
+def prefetch_inputs(filenames: List[Optional[str]], prefetch: int = 4) -> Iterator[Tuple[Optional[str], IO]]:
+    """yield (filename, binary file pointer) in order while the next `prefetch` files are being opened
+
+    every file pointer is closed once the consumer asks for the next one
+
+    :param filenames: the expanded filenames (None for stdin)
+    :type filenames: List[Optional[str]]
+    :param prefetch: the number of files opened (downloaded) ahead in background threads
+    :type prefetch: int
+    :return: an iterator of (filename, binary file pointer)
+    :rtype: Iterator[Tuple[Optional[str], IO]]
+    """
+    if prefetch < 1 or len(filenames) < 2:
+        for filename in filenames:
+            fp = _open(filename, download=False)
+            try:
+                yield filename, fp
+            finally:
+                if fp is not sys.stdin.buffer:
+                    fp.close()
+        return
+
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        futures = [pool.submit(_open, x) for x in filenames[:prefetch]]
+        try:
+            for k, filename in enumerate(filenames):
+                fp = futures[k].result()
+                if k + prefetch < len(filenames):
+                    futures.append(pool.submit(_open, filenames[k + prefetch]))
+                try:
+                    yield filename, fp
+                finally:
+                    futures[k] = None
+                    if fp is not sys.stdin.buffer:
+                        fp.close()
+        finally:
+            # the consumer stopped early: don't start the pending downloads
+            for future in futures:
+                if future is not None:
+                    future.cancel()
@@ -0,0 +1,172 @@
+"""Projection, filtering and validation of jsonl records
+
+    A JsonlProcessor parses a batch of raw lines at once (orjson when it is installed,
+    the standard json module otherwise) and returns the bytes to be written:
+        fields      `a.b,c` -> {"a.b": ..., "c": ...}, missing fields are null,
+                    integers select list items (`items.0.id`)
+        where       `path OP value` with OP in ==, !=, >, >=, <, <=, ~ (regex search),
+                    `path` (the field is truthy) or `!path` (missing or falsy),
+                    the value is a json literal (5, "x", true, null) or a bare string
+        validate    malformed lines are reported (with their line number) and skipped,
+                    without it the first malformed line raises MalformedLineError
+
+    The selected records are copied as they are when no fields are given, so
+    filtering doesn't re-serialize them.
+
+    Example:
+        processor = JsonlProcessor(fields=parse_fields("user.id,ts"), where=[parse_where("status == 500")])
+        data = processor.process(lines, first_line=0, filename="logs.jsonl")
+"""
+import json
+import re
+import sys
+from typing import Any, Callable, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# a path of keys (str) and list indexes (int)
+Path = Tuple[Any, ...]
+
+WHERE_REGEX = re.compile(r"^\s*(?P<path>[^\s=!<>~]+)\s*(?P<op>==|!=|>=|<=|>|<|~)\s*(?P<value>.*?)\s*$")
+EXISTS_REGEX = re.compile(r"^\s*(?P<negate>!?)\s*(?P<path>[^\s=!<>~]+)\s*$")
+
+_MISSING = object()
+
+
+class MalformedLineError(ValueError):
+    """a line that is not valid json"""
+
+    def __init__(self, filename: Optional[str], line: int, message: str):
+        self.filename = filename
+        self.line = line
+        super().__init__(f"{filename or 'standard input'}:{line}: malformed json ({message})")
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(record: Any) -> bytes:
+        return orjson.dumps(record)
+else:
+    loads = json.loads
+
+    def dumps(record: Any) -> bytes:
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+
+
+def parse_path(name: str) -> Path:
+    """`a.b.0` -> ("a", "b", 0)"""
+    return tuple(int(x) if x.lstrip("-").isdigit() else x for x in name.split("."))
+
+
+def parse_fields(spec: str) -> List[Tuple[str, Path]]:
+    """`a.b,c` -> [("a.b", ("a", "b")), ("c", ("c",))]"""
+    return [(x.strip(), parse_path(x.strip())) for x in spec.split(",") if x.strip()]
+
+
+def get_path(record: Any, path: Path, default: Any = None) -> Any:
+    """the value at the path of the record, `default` if any step is missing"""
+    for key in path:
+        try:
+            record = record[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+    return record
+
+
+def _parse_value(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_where(expr: str) -> Callable[[Any], bool]:
+    """compile a `--where` expression into a predicate of the record
+
+    :param expr: `path OP value`, `path` or `!path`
+    :type expr: str
+    :return: a function record -> bool
+    :rtype: Callable[[Any], bool]
+    """
+    match = EXISTS_REGEX.match(expr)
+    if match:
+        path = parse_path(match["path"])
+        if match["negate"]:
+            return lambda record: not get_path(record, path)
+        return lambda record: bool(get_path(record, path))
+
+    match = WHERE_REGEX.match(expr)
+    if not match:
+        raise ValueError(f"invalid --where expression '{expr}'")
+    path, op = parse_path(match["path"]), match["op"]
+    if op == "~":
+        regex = re.compile(match["value"])
+
+        def search(record: Any) -> bool:
+            value = get_path(record, path)
+            return isinstance(value, str) and regex.search(value) is not None
+
+        return search
+
+    value = _parse_value(match["value"])
+    compare = {
+        "==": lambda x: x == value,
+        "!=": lambda x: x != value,
+        ">": lambda x: x > value,
+        ">=": lambda x: x >= value,
+        "<": lambda x: x < value,
+        "<=": lambda x: x <= value,
+    }[op]
+
+    def predicate(record: Any) -> bool:
+        try:
+            return compare(get_path(record, path))
+        except TypeError:
+            # a missing field or another type (a string compared with a number)
+            return False
+
+    return predicate
+
+
+class JsonlProcessor:
+    """parses batches of jsonl lines, keeps the records matching every predicate and projects their fields"""
+
+    def __init__(self, fields: Optional[List[Tuple[str, Path]]] = None,
+                 where: Optional[List[Callable[[Any], bool]]] = None, validate: bool = False):
+        self.fields = fields or None
+        self.where = where or []
+        self.validate = validate
+        self.malformed = 0
+
+    def _report(self, error: MalformedLineError):
+        if not self.validate:
+            raise error
+        self.malformed += 1
+        print(f"pycat: {error}", file=sys.stderr)
+
+    def process(self, lines: List[bytes], first_line: int = 0, filename: Optional[str] = None) -> bytes:
+        """the output of a batch of lines, `first_line` is the (0-based) line number of lines[0]"""
+        records, raws = [], []
+        for k, line in enumerate(lines, start=first_line + 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(loads(line))
+            except ValueError as e:
+                self._report(MalformedLineError(filename, k, str(e)))
+                continue
+            raws.append(line)
+
+        if self.where:
+            selected = [k for k, record in enumerate(records) if all(f(record) for f in self.where)]
+            records = [records[k] for k in selected]
+            raws = [raws[k] for k in selected]
+
+        if self.fields is None:
+            return b"".join(x if x.endswith(b"\n") else x + b"\n" for x in raws)
+        fields = self.fields
+        return b"".join(dumps({name: get_path(record, path) for name, path in fields}) + b"\n" for record in records)
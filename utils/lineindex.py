@@ -0,0 +1,147 @@
+"""Byte offset index of every K-th line of a local or cloud file
+
+    The index lets a reader jump close to line N (a local seek or a ranged GET)
+    instead of reading and discarding every line before it:
+        local files     -> sidecar file next to the data, `<filename>.pycat.idx`
+        cloud files     -> `~/.cache/pycat/<sha1 of the uri>.idx` ($XDG_CACHE_HOME is honored)
+
+    The index is incremental: it remembers how many bytes were scanned, so when
+    the file grows only the new tail is scanned. A checksum of the last scanned
+    bytes detects files that were rewritten instead of appended.
+
+    Example:
+        with open_range_reader(filename) as reader:
+            index = LineIndex.open(filename, reader)
+            byte_offset, skip_lines = index.locate(50_000_000)
+"""
+import hashlib
+import json
+import os
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+from utils.cache import cache_dir
+from utils.rangeio import RangeReader, LocalRangeReader
+
+# every K-th line offset is saved
+INDEX_EVERY = 1000
+# bytes scanned at once
+SCAN_SIZE = 8 * 1024 * 1024
+# bytes before the end of the scanned region used to detect rewritten files
+CHECK_SIZE = 4096
+INDEX_VERSION = 1
+
+
+def cache_path(filename: str) -> str:
+    """the index path inside the cache directory"""
+    return os.path.join(cache_dir("pycat"), hashlib.sha1(filename.encode("utf8")).hexdigest() + ".idx")
+
+
+def index_path(filename: str, reader: RangeReader) -> str:
+    """sidecar path for local files, cache path for cloud files"""
+    # the raw reader of a compressed file (the offsets are still decompressed offsets)
+    raw = getattr(reader, "raw", reader)
+    if isinstance(raw, LocalRangeReader):
+        return raw.path + ".pycat.idx"
+    return cache_path(filename)
+
+
+class LineIndex:
+    """offsets[j] is the byte offset where the line j * every starts"""
+
+    def __init__(self, every: int = INDEX_EVERY):
+        self.every = every
+        self.offsets: List[int] = [0]
+        # bytes scanned and newlines found in them
+        self.size = 0
+        self.lines = 0
+        self.checksum = 0
+
+    @classmethod
+    def open(cls, filename: str, reader: RangeReader, every: int = INDEX_EVERY) -> "LineIndex":
+        """load the index of the file, bring it up to date and save it when it changed"""
+        path = index_path(filename, reader)
+        # a read-only directory keeps the index in the cache
+        if not os.path.exists(path) and os.path.exists(cache_path(filename)):
+            path = cache_path(filename)
+        index = cls.load(path, every=every)
+        if not index.is_valid(reader):
+            index = cls(every=every)
+        if index.update(reader):
+            try:
+                index.save(path)
+            except OSError:
+                # a read-only directory (or filesystem) keeps the index in the cache,
+                # without a writable cache the index is only used by this call
+                try:
+                    index.save(cache_path(filename))
+                except OSError:
+                    pass
+        return index
+
+    @classmethod
+    def load(cls, path: str, every: int = INDEX_EVERY) -> "LineIndex":
+        """load an index (an empty one if it doesn't exist, is corrupted or has another K)"""
+        index = cls(every=every)
+        try:
+            with open(path, "r") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") != INDEX_VERSION or data.get("every") != every:
+            return index
+        index.offsets = data["offsets"]
+        index.size = data["size"]
+        index.lines = data["lines"]
+        index.checksum = data["checksum"]
+        return index
+
+    def save(self, path: str):
+        """write the index atomically"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            "version": INDEX_VERSION,
+            "every": self.every,
+            "size": self.size,
+            "lines": self.lines,
+            "checksum": self.checksum,
+            "offsets": self.offsets,
+        }
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as fp:
+                json.dump(data, fp)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _tail_checksum(self, reader: RangeReader) -> int:
+        start = max(0, self.size - CHECK_SIZE)
+        return zlib.crc32(reader.read(start, self.size - start))
+
+    def is_valid(self, reader: RangeReader) -> bool:
+        """True if the file still starts with the scanned bytes (it was only appended)"""
+        return self.size <= reader.size and self._tail_checksum(reader) == self.checksum
+
+    def update(self, reader: RangeReader) -> bool:
+        """scan the bytes appended since the last update, True if something was scanned"""
+        if self.size >= reader.size:
+            return False
+        while self.size < reader.size:
+            chunk = reader.read(self.size, SCAN_SIZE)
+            # positions of every newline in the chunk, the line after the i-th newline is line lines + i + 1
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            first = -(self.lines + 1) % self.every
+            self.offsets.extend((newlines[first::self.every] + self.size + 1).tolist())
+            self.lines += len(newlines)
+            self.size += len(chunk)
+        self.checksum = self._tail_checksum(reader)
+        return True
+
+    def locate(self, line: int) -> Tuple[int, int]:
+        """the byte offset of the nearest indexed line before `line` and the lines to skip after it"""
+        checkpoint = min(line // self.every, len(self.offsets) - 1)
+        return self.offsets[checkpoint], line - checkpoint * self.every
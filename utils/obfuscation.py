@@ -0,0 +1,268 @@
+"""Vectorized obfuscation of the text columns of a table
+
+    A column is processed as a single array of unicode codepoints (the cells one after the other)
+    with random masks drawn by a numpy generator:
+        homoglyphs      -> every character with homoglyphs is replaced with probability p_obf,
+                           the replacement comes from a codepoint table (HOMOGLYPH_TABLE)
+        separators      -> every space becomes ", " or "; " with probability P_SEPARATOR
+        empty rows      -> after every row, with probability p_empty, 3 to 10 empty rows are inserted
+
+    The same generator (np.random.default_rng(seed)) gives the same output.
+
+    Large tables are obfuscated in chunks (obfuscate_chunks) by a pool of processes, the generator
+    of every chunk is derived from the master seed and the chunk index (chunk_rng), so the output only
+    depends on the seed and the chunk size, not on the number of processes.
+
+    Example:
+        rng = np.random.default_rng(42)
+        df = obfuscate(df, [("name", True), ("city", False)], p_obf=0.01, p_empty=0.2, rng=rng)
+
+        for df in obfuscate_chunks(pd.read_csv("big.csv", dtype=str, chunksize=100_000), flags, 0.01, 0.2,
+                                   seed=42, jobs=8):
+            ...
+"""
+from concurrent.futures import ProcessPoolExecutor
+from random import choice, random
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.parallel import ordered_map
+
+# probability of a space becoming ", " or "; "
+P_SEPARATOR = 0.35
+SEPARATORS = np.array([ord(","), ord(";")], dtype=np.uint32)
+SPACE = ord(" ")
+# empty rows inserted after a row: randint(3, 10)
+MIN_EMPTY_ROWS = 3
+MAX_EMPTY_ROWS = 10
+
+
+class Homoglyph:
+    HOMOGLYPHS = {
+        # Lowercase
+        "a": ["а"],  # Cyrillic a
+        "c": ["с"],  # Cyrillic es
+        "e": ["е"],  # Cyrillic ie
+        "g": ["ɡ"],  # Latin small letter script g (confusable)
+        "i": ["і"],  # Cyrillic i
+        "j": ["ј"],  # Cyrillic je
+        "l": ["ⅼ"],  # Roman numeral fifty
+        "o": ["о"],  # Cyrillic o
+        "p": ["р"],  # Cyrillic er
+        "q": ["ԛ"],  # Cyrillic qa
+        "s": ["ѕ"],  # Cyrillic dze
+        "u": ["υ"],  # Greek upsilon
+        "v": ["ν"],  # Greek nu
+        "x": ["х"],  # Cyrillic ha
+        "y": ["у"],  # Cyrillic u
+        "z": ["ᴢ"],  # Modifier small capital Z
+
+        # Uppercase
+        "A": ["Α", "А"],  # Greek Alpha, Cyrillic A
+        "B": ["Β", "В"],  # Greek Beta, Cyrillic Ve
+        "C": ["Ϲ", "С"],  # Greek Sigma, Cyrillic Es
+        "D": ["Ꭰ"],  # Cherokee A
+        "E": ["Ε", "Е"],  # Greek Epsilon, Cyrillic Ie
+        "H": ["Η", "Н"],  # Greek Eta, Cyrillic En
+        "I": ["Ι", "І"],  # Greek Iota, Cyrillic I
+        "J": ["Ј"],  # Cyrillic Je
+        "K": ["Κ", "К"],  # Greek Kappa, Cyrillic Ka
+        "L": ["Ꮮ"],  # Cherokee L
+        "M": ["Μ", "М"],  # Greek Mu, Cyrillic Em
+        "N": ["Ν"],  # Greek Nu
+        "O": ["Ο", "О"],  # Greek Omicron, Cyrillic O
+        "P": ["Ρ", "Р"],  # Greek Rho, Cyrillic Er
+        "Q": ["Ԛ"],  # Cyrillic Qa
+        "S": ["Ѕ"],  # Cyrillic Dze
+        "T": ["Τ", "Т"],  # Greek Tau, Cyrillic Te
+        "U": ["Ս"],  # Armenian Se
+        "X": ["Χ", "Х"],  # Greek Chi, Cyrillic Ha
+        "Y": ["Υ"],  # Greek Upsilon, Cyrillic U
+        "Z": ["Ζ"],  # Greek Zeta
+
+        # Digits
+        "0": ["О"],  # Cyrillic O
+        "3": ["З"],  # Cyrillic Ze
+
+        # Symbols
+        "-": ["‐"],  # Hyphen-like
+        "_": ["＿"],  # Fullwidth underscore
+    }
+
+    @classmethod
+    def random_map(cls, c):
+        if c in cls.HOMOGLYPHS:
+            return choice(cls.HOMOGLYPHS[c])
+        return None
+
+    @classmethod
+    def random_sub(cls, text: str, probability: float = 0.3) -> tuple[str, bool]:
+        """the substitution of a single string (the columns are obfuscated by substitute_homoglyphs)"""
+        new_text = []
+        changed = False
+        for c in text:
+            mapped_c = cls.random_map(c) if random() < probability else None
+            if mapped_c:
+                changed = True
+            new_text.append(mapped_c or c)
+        return "".join(new_text), changed
+
+
+def _homoglyph_table() -> Tuple[np.ndarray, np.ndarray]:
+    """the homoglyphs of every (ascii) codepoint as a [128, max homoglyphs] table and their count"""
+    width = max(len(x) for x in Homoglyph.HOMOGLYPHS.values())
+    table = np.zeros((128, width), dtype=np.uint32)
+    counts = np.zeros(128, dtype=np.int64)
+    for c, glyphs in Homoglyph.HOMOGLYPHS.items():
+        table[ord(c), :len(glyphs)] = [ord(x) for x in glyphs]
+        counts[ord(c)] = len(glyphs)
+    return table, counts
+
+
+HOMOGLYPH_TABLE, HOMOGLYPH_COUNTS = _homoglyph_table()
+
+
+def to_codepoints(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """the codepoints of all the strings and the bounds of every string (len(values) + 1 offsets)"""
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    bounds = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=bounds[1:])
+    codepoints = np.frombuffer("".join(values).encode("utf-32-le"), dtype=np.uint32)
+    return codepoints, bounds
+
+
+def from_codepoints(codepoints: np.ndarray, bounds: np.ndarray) -> List[str]:
+    """the strings of to_codepoints"""
+    text = codepoints.astype(np.uint32, copy=False).tobytes().decode("utf-32-le")
+    return [text[a:b] for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+
+def substitute_homoglyphs(codepoints: np.ndarray, p_obf: float, rng: np.random.Generator) -> np.ndarray:
+    """replace every character with homoglyphs by one of them with probability p_obf"""
+    codepoints = codepoints.copy()
+    candidates = np.flatnonzero(codepoints < 128)
+    candidates = candidates[HOMOGLYPH_COUNTS[codepoints[candidates]] > 0]
+    selected = candidates[rng.random(len(candidates)) < p_obf]
+    originals = codepoints[selected]
+    choices = (rng.random(len(selected)) * HOMOGLYPH_COUNTS[originals]).astype(np.int64)
+    codepoints[selected] = HOMOGLYPH_TABLE[originals, choices]
+    return codepoints
+
+
+def insert_separators(codepoints: np.ndarray, bounds: np.ndarray, rng: np.random.Generator,
+                      probability: float = P_SEPARATOR) -> Tuple[np.ndarray, np.ndarray]:
+    """every space becomes ", " or "; " with the given probability, return the new codepoints and bounds"""
+    spaces = np.flatnonzero(codepoints == SPACE)
+    selected = spaces[rng.random(len(spaces)) < probability]
+    if len(selected) == 0:
+        return codepoints, bounds
+    separators = SEPARATORS[rng.integers(0, len(SEPARATORS), len(selected))]
+    # a selected space takes two positions: the separator and the space
+    widths = np.ones(len(codepoints), dtype=np.int64)
+    widths[selected] = 2
+    ends = np.cumsum(widths)
+    result = np.repeat(codepoints, widths)
+    result[ends[selected] - 2] = separators
+    return result, np.concatenate([[0], ends])[bounds]
+
+
+def obfuscate_column(values: List[str], p_obf: float, rng: np.random.Generator,
+                     p_separator: float = P_SEPARATOR) -> List[str]:
+    """homoglyphs and separators of a column of strings"""
+    codepoints, bounds = to_codepoints(values)
+    if p_obf > 0:
+        codepoints = substitute_homoglyphs(codepoints, p_obf, rng)
+    if p_separator > 0:
+        codepoints, bounds = insert_separators(codepoints, bounds, rng, p_separator)
+    return from_codepoints(codepoints, bounds)
+
+
+def insert_empty_rows(df: pd.DataFrame, p_empty: float, rng: np.random.Generator, first_id: int = 1) -> pd.DataFrame:
+    """insert 3 to 10 empty rows after every row with probability p_empty and number all of them in the `id` column"""
+    n = len(df)
+    empty_rows = np.where(rng.random(n) < p_empty, rng.integers(MIN_EMPTY_ROWS, MAX_EMPTY_ROWS + 1, n), 0)
+    # the position of every row of df in the result
+    positions = np.arange(n) + np.cumsum(empty_rows) - empty_rows
+    total = n + int(empty_rows.sum())
+    data = {}
+    for column in df.columns:
+        values = np.full(total, "", dtype=object)
+        values[positions] = df[column].to_numpy(dtype=object)
+        data[column] = values
+    data["id"] = np.arange(first_id, first_id + total)
+    return pd.DataFrame(data)
+
+
+def obfuscate(df: pd.DataFrame, col_names_and_flags: List[Tuple[str, bool]], p_obf: float, p_empty: float,
+              rng: Optional[np.random.Generator] = None, first_id: int = 1) -> pd.DataFrame:
+    """obfuscate the flagged columns of a table of strings and pad it with empty rows
+
+    :param df: the table (string columns without missing values)
+    :type df: pd.DataFrame
+    :param col_names_and_flags: the columns and whether they are obfuscated
+    :type col_names_and_flags: List[Tuple[str, bool]]
+    :param p_obf: probability of substituting a character with a homoglyph
+    :type p_obf: float
+    :param p_empty: probability of inserting empty rows after a row
+    :type p_empty: float
+    :param rng: the random generator (a new unseeded one if None)
+    :type rng: Optional[np.random.Generator]
+    :param first_id: the id of the first row
+    :type first_id: int
+    :return: a new dataframe with the columns of df and `id`
+    :rtype: pd.DataFrame
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    df = df.copy()
+    for col_name, obfuscate_flag in col_names_and_flags:
+        if obfuscate_flag:
+            df[col_name] = obfuscate_column(df[col_name].tolist(), p_obf, rng)
+    return insert_empty_rows(df, p_empty, rng, first_id)
+
+
+def chunk_rng(seed: int, index: int) -> np.random.Generator:
+    """the generator of the chunk `index`, derived from the master seed"""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+
+
+def obfuscate_chunk(df: pd.DataFrame, col_names_and_flags: List[Tuple[str, bool]], p_obf: float, p_empty: float,
+                    seed: int, index: int) -> pd.DataFrame:
+    """obfuscate the chunk `index` of a table (its ids start at 1)"""
+    return obfuscate(df, col_names_and_flags, p_obf, p_empty, rng=chunk_rng(seed, index))
+
+
+def obfuscate_chunks(chunks: Iterable[pd.DataFrame], col_names_and_flags: List[Tuple[str, bool]], p_obf: float,
+                     p_empty: float, seed: int, jobs: int = 1) -> Iterator[pd.DataFrame]:
+    """obfuscate the chunks of a table in `jobs` processes and yield them in order
+
+    only 2 * jobs chunks are read ahead, so the memory is bounded by the chunk size.
+    the ids of the padded rows continue from one chunk to the next
+
+    :param chunks: the chunks of the table (string columns without missing values)
+    :type chunks: Iterable[pd.DataFrame]
+    :param col_names_and_flags: the columns and whether they are obfuscated
+    :type col_names_and_flags: List[Tuple[str, bool]]
+    :param p_obf: probability of substituting a character with a homoglyph
+    :type p_obf: float
+    :param p_empty: probability of inserting empty rows after a row
+    :type p_empty: float
+    :param seed: the master seed
+    :type seed: int
+    :param jobs: the number of processes, 1 obfuscates in this process
+    :type jobs: int
+    :return: an iterator of the obfuscated chunks
+    :rtype: Iterator[pd.DataFrame]
+    """
+    tasks = ((df, col_names_and_flags, p_obf, p_empty, seed, k) for k, df in enumerate(chunks))
+    next_id = 1
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        for df in ordered_map(pool, obfuscate_chunk, tasks, window=2 * jobs):
+            df["id"] += next_id - 1
+            next_id += len(df)
+            yield df
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,81 @@
+"""Buffered bulk output of raw bytes to stdout
+
+    print() per line checks the line ending, encodes the text and (when stdout is a pipe)
+    may flush on every call. BlockWriter collects raw bytes and writes them to
+    sys.stdout.buffer in large blocks of `buffer_size` bytes.
+
+    A closed pipe (`pycat big.jsonl | head`) ends the program quietly: stdout is
+    redirected to /dev/null so the interpreter doesn't complain at exit.
+
+    Example:
+        with BlockWriter() as writer:
+            for line in fp:
+                writer.write_line(line)
+"""
+import os
+import sys
+from typing import IO, Optional
+
+# bytes collected before every write
+BUFFER_SIZE = 1024 * 1024
+
+
+def exit_on_broken_pipe():
+    """the reader of stdout is gone, silence stdout and exit (see the python docs on SIGPIPE)"""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(1)
+
+
+class BlockWriter:
+    """writes raw bytes to a binary stream (stdout by default) in blocks of `buffer_size` bytes"""
+
+    def __init__(self, out: Optional[IO] = None, buffer_size: int = BUFFER_SIZE):
+        # text already printed must come first
+        sys.stdout.flush()
+        self.out = sys.stdout.buffer if out is None else out
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, data: bytes):
+        """collect the bytes, the block is written when it is full"""
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_line(self, line: bytes):
+        """collect a line adding the newline if it doesn't have one"""
+        self.write(line if line.endswith(b"\n") else line + b"\n")
+
+    def write_header(self, filename: Optional[str], first: bool = False):
+        """writes the `==> FILENAME <==` header of a file (like coreutils head/tail)"""
+        name = "standard input" if filename is None or filename == "-" else filename
+        if not first:
+            self.write(b"\n")
+        self.write(f"==> {name} <==\n".encode("utf8"))
+
+    def flush(self):
+        """write the collected block to the stream"""
+        if self.parts:
+            data = b"".join(self.parts)
+            self.parts = []
+            self.size = 0
+            try:
+                self.out.write(data)
+            except BrokenPipeError:
+                exit_on_broken_pipe()
+        try:
+            self.out.flush()
+        except BrokenPipeError:
+            exit_on_broken_pipe()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,35 @@
+"""Ordered map over a pool with a bounded window of submitted tasks
+
+    The tools split their input in tasks (ranges of a file, chunks of a table, compressed blocks)
+    and need the results in the order of the tasks without submitting the whole input at once:
+        window      -> at most `window` tasks are submitted ahead of the consumer
+        no pool     -> the tasks run one by one in the calling process
+
+    Example:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for result in ordered_map(pool, work, ((start, end) for start, end in ranges), window=2 * jobs):
+                ...
+"""
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Iterator, Optional
+
+
+def ordered_map(pool: Optional[Executor], fn: Callable, tasks: Iterator[tuple], window: int) -> Iterator:
+    """fn(*task) of every task (in the pool when given) keeping `window` tasks ahead, in order"""
+    if pool is None:
+        for task in tasks:
+            yield fn(*task)
+        return
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(pool.submit(fn, *task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # the consumer stopped early: the queued tasks are not run
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,257 @@
+"""Random access (ranged) reads for local and cloud files
+
+    A RangeReader knows the size of a file and is able to read any byte range
+    of it without touching the rest of the file:
+        local files     -> os.pread over a single file descriptor
+        s3://           -> GetObject with a `Range` header (boto3)
+        gs://           -> blob.download_as_bytes(start, end) (google-cloud-storage)
+        http(s)://      -> GET with a `Range` header (requests)
+
+    Compressed files with independent frames (zstd with a seek table, local bgzf files)
+    are read by ranges of their decompressed bytes (see utils.compression).
+
+    Sources that cannot be read by ranges (stdin, pipes, other compressed files,
+    servers without range support, unknown schemes) raise NotSeekableError,
+    callers are expected to fall back to a streaming read in that case.
+
+    Example:
+        reader = open_range_reader("s3://bucket/key.log")
+        last_kb = reader.read(reader.size - 1024, 1024)
+"""
+import io
+import os
+import stat
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+# bytes read at once looking for the next line
+SCAN_SIZE = 64 * 1024
+
+
+class NotSeekableError(Exception):
+    """The source can't be read by byte ranges, use a streaming read instead"""
+
+
+def is_stdin(filename: Optional[str]) -> bool:
+    """True when the filename refers to the standard input"""
+    return filename is None or filename == "-"
+
+
+def split_bucket_key(uri: str) -> Tuple[str, str]:
+    """split a cloud uri like s3://bucket/path/to/key into ("bucket", "path/to/key")"""
+    parsed = urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+class RangeReader:
+    """Base class for ranged readers, it counts the bytes fetched in `bytes_read` and the `requests`"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.bytes_read = 0
+        self.requests = 0
+        self._size = None
+
+    @property
+    def size(self) -> int:
+        """the total size of the file in bytes"""
+        if self._size is None:
+            self._size = self._fetch_size()
+        return self._size
+
+    def refresh(self) -> int:
+        """forget the cached size and query it again (the file may have grown)"""
+        self._size = None
+        return self.size
+
+    def read(self, start: int, length: int) -> bytes:
+        """read `length` bytes starting at `start`, less bytes are returned at the end of the file"""
+        if length <= 0 or start >= self.size:
+            return b""
+        length = min(length, self.size - start)
+        data = self._read_range(start, start + length - 1)
+        self.bytes_read += len(data)
+        self.requests += 1
+        return data
+
+    def close(self):
+        """release any resource held by the reader"""
+
+    def _fetch_size(self) -> int:
+        raise NotImplementedError
+
+    def _read_range(self, first: int, last: int) -> bytes:
+        """read the inclusive byte range [first, last]"""
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalRangeReader(RangeReader):
+    """Ranged reads over a local file using pread"""
+
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        path = filename[len("file://"):] if filename.startswith("file://") else filename
+        self.path = os.path.expanduser(path)
+        self.fd = os.open(self.path, os.O_RDONLY)
+        if not stat.S_ISREG(os.fstat(self.fd).st_mode):
+            os.close(self.fd)
+            raise NotSeekableError(f"'{filename}' is not a regular file")
+
+    def _fetch_size(self) -> int:
+        return os.fstat(self.fd).st_size
+
+    def _read_range(self, first: int, last: int) -> bytes:
+        chunks = []
+        offset, remaining = first, last - first + 1
+        while remaining > 0:
+            chunk = os.pread(self.fd, remaining, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class S3RangeReader(RangeReader):
+    """Ranged reads over an S3 object"""
+
+    def __init__(self, filename: str):
+        import boto3
+
+        super().__init__(filename)
+        self.bucket, self.key = split_bucket_key(filename)
+        self.client = boto3.client("s3")
+
+    def _fetch_size(self) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=self.key)["ContentLength"]
+
+    def _read_range(self, first: int, last: int) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={first}-{last}")
+        with response["Body"] as body:
+            return body.read()
+
+
+class GCSRangeReader(RangeReader):
+    """Ranged reads over a Google Cloud Storage blob"""
+
+    def __init__(self, filename: str):
+        from google.cloud import storage
+
+        super().__init__(filename)
+        bucket, key = split_bucket_key(filename)
+        self.blob = storage.Client().bucket(bucket).blob(key)
+
+    def _fetch_size(self) -> int:
+        self.blob.reload()
+        return self.blob.size
+
+    def _read_range(self, first: int, last: int) -> bytes:
+        return self.blob.download_as_bytes(start=first, end=last, raw_download=True)
+
+
+class HTTPRangeReader(RangeReader):
+    """Ranged reads over an http(s) url, the server must accept byte ranges"""
+
+    def __init__(self, filename: str):
+        import requests
+
+        super().__init__(filename)
+        self.session = requests.Session()
+        response = self.session.head(filename, allow_redirects=True)
+        # servers rejecting HEAD (403/405, presigned s3 urls) may still serve a plain GET: stream it
+        if not response.ok:
+            self.session.close()
+            raise NotSeekableError(f"'{filename}' rejected the HEAD request ({response.status_code})")
+        if response.headers.get("Accept-Ranges", "").lower() != "bytes" or "Content-Length" not in response.headers:
+            self.session.close()
+            raise NotSeekableError(f"'{filename}' doesn't support byte ranges")
+        self._size = int(response.headers["Content-Length"])
+
+    def _fetch_size(self) -> int:
+        response = self.session.head(self.filename, allow_redirects=True)
+        response.raise_for_status()
+        return int(response.headers["Content-Length"])
+
+    def _read_range(self, first: int, last: int) -> bytes:
+        response = self.session.get(self.filename, headers={"Range": f"bytes={first}-{last}"})
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise NotSeekableError(f"'{self.filename}' ignored the byte range request")
+        return response.content
+
+    def close(self):
+        self.session.close()
+
+
+class RangeStream(io.RawIOBase):
+    """a sequential readable stream over a RangeReader starting at `start`, wrap it with io.BufferedReader"""
+
+    def __init__(self, reader: RangeReader, start: int = 0):
+        self.reader = reader
+        self.position = start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.reader.read(self.position, len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+        super().close()
+
+
+def line_start(reader: RangeReader, offset: int) -> int:
+    """the offset of the first line starting at or after `offset`"""
+    if offset <= 0:
+        return 0
+    # a line starts at `offset` only if the previous byte is a newline
+    position = offset - 1
+    while position < reader.size:
+        block = reader.read(position, SCAN_SIZE)
+        index = block.find(b"\n")
+        if index >= 0:
+            return position + index + 1
+        position += len(block)
+    return reader.size
+
+
+def open_raw_range_reader(filename: Optional[str]) -> RangeReader:
+    """return the RangeReader of the raw bytes of the given filename or raise NotSeekableError"""
+    if is_stdin(filename):
+        raise NotSeekableError("the standard input is not seekable")
+
+    scheme = urlparse(filename).scheme.lower()
+    # a single letter scheme is a windows drive like C:\
+    if scheme in ("", "file") or len(scheme) == 1:
+        return LocalRangeReader(filename)
+    if scheme in ("s3", "s3a", "s3n", "s3u"):
+        return S3RangeReader(filename)
+    if scheme == "gs":
+        return GCSRangeReader(filename)
+    if scheme in ("http", "https"):
+        return HTTPRangeReader(filename)
+    raise NotSeekableError(f"'{scheme}://' sources are not seekable")
+
+
+def open_range_reader(filename: Optional[str]) -> RangeReader:
+    """return the RangeReader of the (decompressed) bytes of the given filename or raise NotSeekableError"""
+    from utils.compression import wrap_range_reader
+
+    return wrap_range_reader(open_raw_range_reader(filename))
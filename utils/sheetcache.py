@@ -0,0 +1,139 @@
+"""Persistent cache of parsed spreadsheet sheets as Arrow IPC (feather) files
+
+    Parsing an .xlsx file takes seconds, reading a cell of a cached sheet takes milliseconds:
+        key         -> sha1 of the absolute path, its mtime and size and the sheet
+        entry       -> `~/.cache/xlscat/<key>.arrow` ($XDG_CACHE_HOME is honored), a column per sheet
+                       column with the printed text of every cell (null for the missing ones)
+        lookup      -> the entry is memory mapped, only the pages of the requested cells are read
+        eviction    -> the least recently used entries are removed while the cache is larger than the cap,
+                       a hit touches the mtime of its entry
+
+    A modified workbook gets a new key, its old entries are evicted like any other.
+    pyarrow is imported lazily, without it nothing is cached. pandas isn't imported, a hit doesn't need it.
+
+    Example:
+        cache = SheetCache(max_bytes=parse_size("1G"))
+        sheet = cache.get("book.xlsx", 0)
+        if sheet is None:
+            df = pd.read_excel("book.xlsx", header=None)
+            sheet = cache.put("book.xlsx", 0, [df[k].tolist() for k in df.columns])
+        value = sheet.cell(3, 1)
+"""
+import hashlib
+import os
+import tempfile
+from typing import Any, List, Optional, Union
+
+import numpy as np
+
+from utils.cache import cache_dir
+
+DEFAULT_CACHE_SIZE = 1024 ** 3
+CACHE_EXTENSION = ".arrow"
+CACHE_VERSION = 2
+
+
+def is_nan(value: Any) -> bool:
+    """np.isnan for numbers, False for anything else"""
+    try:
+        return bool(np.isnan(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def cell_texts(values: List[Any]) -> List[Optional[str]]:
+    """the printed text of every value, None for nan"""
+    return [None if is_nan(x) else str(x) for x in values]
+
+
+class CachedSheet:
+    """the cells of a cached sheet (a memory mapped arrow table), missing cells are nan"""
+
+    def __init__(self, table):
+        self.table = table
+
+    @property
+    def shape(self):
+        return self.table.num_rows, self.table.num_columns
+
+    def cell(self, row: int, col: int) -> Union[str, float]:
+        """the text of the cell at the 0-based (row, col), IndexError outside of the sheet"""
+        if not 0 <= row < self.table.num_rows:
+            raise IndexError(f"row {row + 1} is out of the sheet")
+        value = self.table.column(col)[row].as_py()
+        return np.nan if value is None else value
+
+
+class SheetCache:
+    """the cache directory with a size cap (bytes) and lru eviction"""
+
+    def __init__(self, folder: Optional[str] = None, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.folder = folder or cache_dir("xlscat")
+        self.max_bytes = max_bytes
+
+    def path(self, filename: str, sheet: Union[int, str]) -> str:
+        """the entry of the current version of the file"""
+        stat = os.stat(filename)
+        key = f"{CACHE_VERSION}\0{os.path.abspath(filename)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{sheet!r}"
+        return os.path.join(self.folder, hashlib.sha1(key.encode("utf8")).hexdigest() + CACHE_EXTENSION)
+
+    def get(self, filename: str, sheet: Union[int, str]) -> Optional[CachedSheet]:
+        """the cached sheet or None"""
+        import pyarrow.feather as feather
+
+        path = self.path(filename, sheet)
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except (OSError, ValueError):
+            # missing or a partial entry of another process
+            return None
+        try:
+            # the last use of the entry
+            os.utime(path)
+        except OSError:
+            pass
+        return CachedSheet(table)
+
+    def put(self, filename: str, sheet: Union[int, str], columns: List[List[Any]]) -> CachedSheet:
+        """cache the parsed sheet (the values of every column, nan for the missing ones) and return it from the cache"""
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        table = pa.table({str(k): pa.array(cell_texts(values), type=pa.string()) for k, values in enumerate(columns)})
+        path = self.path(filename, sheet)
+        os.makedirs(self.folder, exist_ok=True)
+        # written aside and renamed, a concurrent reader never sees a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        os.close(fd)
+        try:
+            feather.write_feather(table, temp_path, compression="uncompressed")
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict(keep=path)
+        return CachedSheet(feather.read_table(path, memory_map=True))
+
+    def evict(self, keep: Optional[str] = None):
+        """remove the least recently used entries while the cache is larger than the cap"""
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,17 @@
+"""Human readable sizes: `512MB`, `2G`, `1.5GiB` or a number of bytes
+
+    Example:
+        mem_limit = parse_size("512MB")
+"""
+import re
+
+SIZE_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_size(text: str) -> int:
+    """`512MB`, `2G`, `1.5GiB` or a number of bytes"""
+    match = SIZE_REGEX.match(text)
+    if not match:
+        raise ValueError(f"invalid size '{text}', use a number of bytes or a number with a K, M, G or T unit")
+    return int(float(match[1]) * SIZE_UNITS[match[2].lower()])
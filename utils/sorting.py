@@ -0,0 +1,225 @@
+"""External merge sort of tables larger than the memory
+
+    The chunks of a table are collected until they reach half of the memory limit, then
+    they are sorted and spilled to a temporary directory as a run (pickled blocks of rows).
+    The runs are k-way merged in batches: a block of every run is loaded, the first of the last
+    loaded rows of the runs bounds the batch (every row still on disk sorts after it), the rows
+    of every run before the bound are found by a binary search, merged and emitted, the
+    rest of the blocks waits for the next batch. More than FAN_IN runs are merged in several passes.
+
+    Every row carries its position in the input, it breaks the ties so the result is the
+    same as a stable in-memory sort (DataFrame.sort_values with the missing values last).
+    With `top` only the first K rows are kept after every chunk (a bounded selection).
+
+    Example:
+        sorter = ExternalSorter(["amount", "id"], ascending=[False, True], mem_limit=parse_size("512MB"))
+        for df in chunks:
+            sorter.add(df)
+        for block in sorter.sorted_blocks():
+            ...
+"""
+import os
+import pickle
+import shutil
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# the column with the input position of every row
+ROW = "__row__"
+DEFAULT_MEM_LIMIT = 1024 ** 3
+# runs merged at once
+FAN_IN = 16
+
+
+def parse_sort_keys(spec: str) -> Tuple[List[str], List[bool]]:
+    """`country,amount:desc` -> (["country", "amount"], [True, False])"""
+    keys, ascending = [], []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, sep, order = item.strip().rpartition(":")
+        if not sep or order.strip().lower() not in ("asc", "desc"):
+            # a column name with a colon (or without an order)
+            name, order = item.strip(), "asc"
+        keys.append(name.strip())
+        ascending.append(order.strip().lower() == "asc")
+    return keys, ascending
+
+
+class ExternalSorter:
+    """sorts the chunks of a table with a bounded memory, spilling sorted runs to a temporary directory"""
+
+    def __init__(self, by: List[str], ascending: Optional[List[bool]] = None, mem_limit: int = DEFAULT_MEM_LIMIT,
+                 top: Optional[int] = None, fan_in: int = FAN_IN, tmp_dir: Optional[str] = None):
+        self.by = list(by)
+        self.ascending = list(ascending) if ascending is not None else [True] * len(self.by)
+        self.mem_limit = mem_limit
+        self.top = top
+        self.fan_in = max(2, fan_in)
+        self.tmp_dir = tmp_dir
+        self.folder: Optional[str] = None
+        self.runs: List[str] = []
+        self.buffer: List[pd.DataFrame] = []
+        self.buffer_bytes = 0
+        self.rows = 0
+        # rows of the spilled blocks and rows loaded by a merge (of all its runs), fixed by the first run
+        self.block_rows: Optional[int] = None
+        self.merge_rows: Optional[int] = None
+        self.run_count = 0
+
+    @property
+    def spilled(self) -> bool:
+        return len(self.runs) > 0
+
+    def _sort(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df.sort_values(self.by + [ROW], ascending=self.ascending + [True], na_position="last",
+                              ignore_index=True)
+
+    def add(self, df: pd.DataFrame):
+        """add the next chunk of the table"""
+        df = df.assign(**{ROW: np.arange(self.rows, self.rows + len(df))})
+        self.rows += len(df)
+        if self.top is not None:
+            # only the best K rows are kept
+            self.buffer = [self._sort(pd.concat(self.buffer + [df], ignore_index=True)).head(self.top)]
+            return
+        self.buffer.append(df)
+        self.buffer_bytes += int(df.memory_usage(deep=True).sum())
+        if self.buffer_bytes >= self.mem_limit // 2:
+            self._spill()
+
+    def _spill(self):
+        run = self._sort(pd.concat(self.buffer, ignore_index=True))
+        self.buffer, self.buffer_bytes = [], 0
+        if self.block_rows is None:
+            # a block of every merged run (and the rows waiting for them) fit in half of the limit
+            row_bytes = max(1, int(run.memory_usage(deep=True).sum()) // max(1, len(run)))
+            self.block_rows = max(1, self.mem_limit // 2 // (2 * self.fan_in) // row_bytes)
+            self.merge_rows = max(1, self.mem_limit // 2 // 2 // row_bytes)
+        self.runs.append(self._write_run(iter([run])))
+
+    def _write_run(self, blocks: Iterator[pd.DataFrame]) -> str:
+        if self.folder is None:
+            self.folder = tempfile.mkdtemp(prefix="csvc-sort-", dir=self.tmp_dir)
+        path = os.path.join(self.folder, f"run-{self.run_count:06d}.pkl")
+        self.run_count += 1
+        with open(path, "wb") as fp:
+            for block in blocks:
+                for k in range(0, len(block), self.block_rows):
+                    pickle.dump(block.iloc[k:k + self.block_rows], fp, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[pd.DataFrame]:
+        with open(path, "rb") as fp:
+            while True:
+                try:
+                    yield pickle.load(fp)
+                except EOFError:
+                    return
+
+    def _precedes(self, values: list, bounds: list) -> bool:
+        """whether the sort keys `values` (and input position) sort before `bounds`, missing values go last"""
+        for value, bound, ascending in zip(values, bounds, self.ascending + [True]):
+            value_missing, bound_missing = pd.isna(value), pd.isna(bound)
+            if value_missing or bound_missing:
+                if value_missing and bound_missing:
+                    continue
+                return bound_missing
+            if value != bound:
+                return value < bound if ascending else value > bound
+        return False
+
+    def _keys(self, block: pd.DataFrame, k: int) -> list:
+        return [block[key].iat[k] for key in self.by + [ROW]]
+
+    def _before(self, block: pd.DataFrame, bounds: list) -> int:
+        """the rows of a sorted block that sort before `bounds` (a binary search)"""
+        low, high = 0, len(block)
+        while low < high:
+            middle = (low + high) // 2
+            if self._precedes(self._keys(block, middle), bounds):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _merge(self, runs: List[Iterator[pd.DataFrame]]) -> Iterator[pd.DataFrame]:
+        """k-way merge of sorted runs yielding sorted blocks
+
+        the run whose last loaded row sorts first bounds the batch: its loaded rows and the rows of the
+        other runs before that row are merged and emitted, the rest of their blocks waits for the next batch
+        (every row is sorted once, in the batch it is emitted)
+        """
+        # fewer runs load larger blocks (several spilled blocks at once), so there are fewer batches
+        load_rows = max(self.block_rows, self.merge_rows // len(runs))
+
+        def load(run: Iterator[pd.DataFrame]) -> Optional[pd.DataFrame]:
+            loaded, rows = [], 0
+            while rows < load_rows:
+                block = next(run, None)
+                if block is None:
+                    break
+                loaded.append(block)
+                rows += len(block)
+            return pd.concat(loaded, ignore_index=True) if rows > 0 else None
+
+        blocks = {}
+        for k, run in enumerate(runs):
+            block = load(run)
+            if block is not None:
+                blocks[k] = block
+        while blocks:
+            # the last loaded row of every run, the first of them bounds the batch
+            bounds = None
+            for block in blocks.values():
+                keys = self._keys(block, len(block) - 1)
+                if bounds is None or self._precedes(keys, bounds):
+                    bounds = keys
+            batch = []
+            for k in list(blocks):
+                block = blocks[k]
+                cut = len(block) if block[ROW].iat[-1] == bounds[-1] else self._before(block, bounds)
+                if cut > 0:
+                    batch.append(block.iloc[:cut])
+                if cut < len(block):
+                    blocks[k] = block.iloc[cut:]
+                    continue
+                # the whole block was used: the next one of the run
+                block = load(runs[k])
+                if block is not None:
+                    blocks[k] = block
+                else:
+                    del blocks[k]
+            yield self._sort(pd.concat(batch, ignore_index=True))
+
+    def sorted_blocks(self) -> Iterator[pd.DataFrame]:
+        """the sorted table in blocks (a single block when nothing was spilled), the temporary files are removed"""
+        try:
+            if not self.runs:
+                if self.buffer:
+                    yield self._sort(pd.concat(self.buffer, ignore_index=True)).drop(columns=ROW)
+                return
+            if self.buffer:
+                self._spill()
+            # several passes when there are too many runs
+            while len(self.runs) > self.fan_in:
+                runs, self.runs = self.runs, []
+                for k in range(0, len(runs), self.fan_in):
+                    group = runs[k:k + self.fan_in]
+                    self.runs.append(self._write_run(self._merge([self._read_run(x) for x in group])))
+                    for path in group:
+                        os.remove(path)
+            for block in self._merge([self._read_run(x) for x in self.runs]):
+                yield block.drop(columns=ROW)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+        self.runs = []
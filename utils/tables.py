@@ -0,0 +1,196 @@
+"""Column-pruned, typed reads and chunked writes of csv, parquet and feather tables
+
+    The format is taken from the file extension:
+        .parquet, .pq           -> parquet (pyarrow), read by row groups/batches with only the needed columns
+        .feather, .arrow        -> feather v2 (arrow ipc), memory mapped and read with only the needed columns
+        anything else           -> csv (pandas.read_csv with usecols, dtype and the c, python or pyarrow engine)
+
+    pyarrow is only imported for parquet/feather files and for the pyarrow csv engine.
+
+    Example:
+        for df in read_chunks("big.csv", usecols=["id", "amount"], dtypes={"amount": "float64"}, chunksize=100_000):
+            ...
+        with TableWriter("out.parquet") as writer:
+            writer.write(df)
+"""
+import os
+from typing import Dict, IO, Iterator, List, Optional
+
+import pandas as pd
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+FEATHER_EXTENSIONS = (".feather", ".arrow")
+ENGINES = ("c", "python", "pyarrow")
+
+
+def file_format(filename: str) -> str:
+    """csv, parquet or feather according to the extension"""
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    if extension in FEATHER_EXTENSIONS:
+        return "feather"
+    return "csv"
+
+
+def parse_dtypes(spec: Optional[str]) -> Dict[str, str]:
+    """`id:int64,price:float32,country:category` -> {"id": "int64", "price": "float32", "country": "category"}"""
+    dtypes = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, dtype = item.rpartition(":")
+        if not sep or not name.strip() or not dtype.strip():
+            raise ValueError(f"invalid dtype '{item}', use NAME:TYPE")
+        dtypes[name.strip()] = dtype.strip()
+    return dtypes
+
+
+def read_header(filename: str, skip_rows: int = 0) -> List[str]:
+    """the column names of the table (only the header row or the schema is read)"""
+    fmt = file_format(filename)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(filename).names
+    if fmt == "feather":
+        import pyarrow as pa
+
+        with pa.memory_map(filename) as source:
+            return pa.ipc.open_file(source).schema.names
+    return pd.read_csv(filename, skiprows=skip_rows, nrows=0).columns.tolist()
+
+
+def read_chunks(filename: str, usecols: Optional[List[str]] = None, dtypes: Optional[Dict[str, str]] = None,
+                skip_rows: int = 0, engine: str = "c", chunksize: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """yield the table in chunks of `chunksize` rows (a single dataframe without chunksize)
+
+    :param filename: the csv, parquet or feather file
+    :type filename: str
+    :param usecols: the columns to be parsed (all of them if None)
+    :type usecols: Optional[List[str]]
+    :param dtypes: the type of some columns (pandas dtype names)
+    :type dtypes: Optional[Dict[str, str]]
+    :param skip_rows: lines skipped before the csv header (ignored by parquet and feather)
+    :type skip_rows: int
+    :param engine: the csv parser: c, python or pyarrow (multithreaded, it can't be used with chunks)
+    :type engine: str
+    :param chunksize: the rows of every chunk
+    :type chunksize: Optional[int]
+    :return: an iterator of dataframes
+    :rtype: Iterator[pd.DataFrame]
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine '{engine}', use one of {', '.join(ENGINES)}")
+    fmt = file_format(filename)
+    if fmt == "csv":
+        if engine == "pyarrow" and chunksize:
+            raise ValueError("the pyarrow engine can't read csv files in chunks")
+        kwargs = dict(skiprows=skip_rows, usecols=usecols, dtype=dtypes or None, engine=engine)
+        if chunksize:
+            yield from pd.read_csv(filename, chunksize=chunksize, **kwargs)
+        else:
+            yield pd.read_csv(filename, **kwargs)
+        return
+
+    if fmt == "parquet" and chunksize:
+        import pyarrow.parquet as pq
+
+        chunks = (x.to_pandas() for x in pq.ParquetFile(filename).iter_batches(batch_size=chunksize, columns=usecols))
+    elif fmt == "parquet":
+        chunks = iter([pd.read_parquet(filename, columns=usecols)])
+    else:
+        import pyarrow.feather as feather
+
+        # memory mapped: only the needed columns are touched, the chunks are slices of them
+        df = feather.read_table(filename, columns=usecols, memory_map=True).to_pandas()
+        step = chunksize or max(1, len(df))
+        chunks = (df.iloc[k:k + step] for k in range(0, max(1, len(df)), step))
+    for df in chunks:
+        yield df.astype(dtypes) if dtypes else df
+
+
+class TableWriter:
+    """writes dataframes (chunks of the same table) to a csv, parquet or feather file or stream
+
+    the schema of the parquet/feather file is the one of the first chunk, the next chunks are cast to it
+    (ValueError when a column can't be cast without losing values, e.g. 2.5 in a column of ints: the
+    type of the column must be given to the reader). a column without values in the first chunk
+    (all missing, its type is only a guess) is a string column
+    """
+
+    def __init__(self, output, fmt: Optional[str] = None):
+        """`output` is a filename or a stream (text or binary for csv, binary for parquet/feather)"""
+        self.output = output
+        self.format = fmt or (file_format(output) if isinstance(output, str) else "csv")
+        self.fp: Optional[IO] = None
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+        self.chunks = 0
+
+    def write(self, df: pd.DataFrame):
+        if self.format == "csv":
+            if self.fp is None:
+                self.fp = open(self.output, "w", newline="") if isinstance(self.output, str) else self.output
+            df.to_csv(self.fp, index=False, header=self.chunks == 0)
+        else:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.schema = self._first_schema(table)
+                self.writer = self._open_writer(self.schema)
+            if not table.schema.equals(self.schema):
+                table = self._cast(table)
+            self.writer.write_table(table)
+        self.rows += len(df)
+        self.chunks += 1
+
+    @staticmethod
+    def _first_schema(table):
+        import pyarrow as pa
+
+        fields = []
+        for field, column in zip(table.schema, table.columns):
+            if pa.types.is_null(field.type) or column.null_count == len(column):
+                field = field.with_type(pa.string())
+            fields.append(field)
+        return pa.schema(fields, metadata=table.schema.metadata)
+
+    def _cast(self, table):
+        """the chunk with the schema of the file, ValueError if a column can't be converted without losing values"""
+        import pyarrow as pa
+
+        columns = []
+        for field, column in zip(self.schema, table.columns):
+            try:
+                columns.append(column.cast(field.type))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                raise ValueError(f"Column '{field.name}' is {field.type} in the first chunk and {column.type} "
+                                 f"in the chunk {self.chunks + 1}, it can't be converted ({e}), "
+                                 f"give the type of the column (csvc --dtypes {field.name}:TYPE)") from e
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def _open_writer(self, schema):
+        import pyarrow as pa
+
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(self.output, schema)
+        return pa.ipc.new_file(self.output, schema)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.fp is not None and isinstance(self.output, str):
+            self.fp.close()
+        self.fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,150 @@
+"""Wait for changes in a local file without busy polling
+
+    InotifyWatcher      Linux only, blocks on an inotify descriptor watching the parent
+                        directory, so writes, truncations and rotations (the file is moved
+                        or deleted and created again) wake up the caller
+    StatWatcher         portable fallback, compares os.stat signatures sleeping with an
+                        exponential backoff between `interval` and `max_interval`
+
+    Example:
+        watcher = watch_file("/var/log/app.log")
+        while True:
+            if watcher.wait(timeout=5.0):
+                ...  # something happened to the file
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Optional, Tuple
+
+# inotify masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Backoff:
+    """exponential backoff between `interval` and `max_interval` seconds, reset() after every change"""
+
+    def __init__(self, interval: float = 1.0, max_interval: float = 30.0):
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.delay = interval
+
+    def reset(self):
+        self.delay = self.interval
+
+    def sleep(self, limit: Optional[float] = None):
+        """sleep the current delay (at most `limit` seconds) and double it for the next time"""
+        time.sleep(self.delay if limit is None else max(0.0, min(self.delay, limit)))
+        self.delay = min(2 * self.delay, self.max_interval)
+
+
+class StatWatcher:
+    """portable watcher based on os.stat signatures (inode, size, mtime)"""
+
+    def __init__(self, path: str, interval: float = 1.0, max_interval: float = 30.0):
+        self.path = path
+        self.backoff = Backoff(interval, max_interval)
+        self.signature = self._signature()
+
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def wait(self, timeout: float) -> bool:
+        """wait until the file changes (True) or the timeout expires (False)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.backoff.sleep(limit=remaining)
+            signature = self._signature()
+            if signature != self.signature:
+                self.signature = signature
+                self.backoff.reset()
+                return True
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux watcher, the kernel wakes us up when the file (or its directory entry) changes"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.name = os.fsencode(os.path.basename(self.path))
+        libc = _load_libc()
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(os.path.dirname(self.path)), WATCH_MASK)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for '{self.path}'")
+
+    def _drain(self) -> bool:
+        """read every pending event, True if any of them is about our file"""
+        found = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return found
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                found = found or name == self.name
+
+    def wait(self, timeout: float) -> bool:
+        """block until the file changes (True) or the timeout expires (False)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable and self._drain():
+                return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available")
+    return libc
+
+
+def watch_file(path: str, interval: float = 1.0, max_interval: float = 30.0):
+    """return an InotifyWatcher when the platform supports it, otherwise a StatWatcher"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except OSError:
+            pass
+    return StatWatcher(path, interval=interval, max_interval=max_interval)
@@ -1,6 +1,7 @@
 """
 Usage:
-    xlscat.py [--rows=ROWS] [--cols=COLS] [--coltype=T] [--colsep=C] [--rowsep=C] [--skip-nan] <PATH>
+    xlscat.py [--rows=ROWS] [--cols=COLS] [--coltype=T] [--colsep=C] [--rowsep=C] [--skip-nan] [--sheet=S]
+              [--no-cache] [--cache-size=SIZE] <PATH>
 
 Arguments:
     <PATH>   the xls file to be printed out
@@ -12,27 +13,175 @@ Options:
     --colsep=C     the character to be used as column separator [default: \t]
     --rowsep=C     the character to be used as row separator [default: \n]
     --skip-nan     flag indicating to not print nan values
+    --sheet=S      the sheet name or its 0-based index [default: 0]
+    --no-cache     parse the workbook without the cache
+    --cache-size=SIZE  maximum size of the cache, the least recently used sheets are removed [default: 1G]
+
+The parsed sheets of excel files are cached in ~/.cache/xlscat ($XDG_CACHE_HOME is honored) by path,
+modification time and sheet, the next calls read the cells from the memory mapped cache.
+With --no-cache only the rows up to the last requested one and the requested columns of xlsx files
+are read (only the requested columns of csv files). The cells of excel files are printed as
+they are stored, with or without the cache (5, not 5.0, even in a column with empty cells).
 """
 import re
+import sys
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
-import pandas as pd
 from docopt import docopt
 
-pd.set_option('display.max_columns', None)
-pd.set_option('display.max_rows', None)
-pd.set_option('display.width', None)
-pd.set_option('max_colwidth', None)
+from utils.sheetcache import CachedSheet, SheetCache
+from utils.sizes import parse_size
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-def openfile(path: str) -> pd.DataFrame:
-    if re.findall(r"\.xlsx?$", path):
-        df = pd.read_excel(path, header=None)
+
+def import_pandas():
+    """pandas is only imported to parse the file, the cached sheets don't need it"""
+    import pandas as pd
+
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', None)
+    pd.set_option('max_colwidth', None)
+    return pd
+
+
+def is_excel(path: str) -> bool:
+    return bool(re.findall(r"\.xlsx?$", path))
+
+
+@contextmanager
+def open_worksheet(path: str, sheet: Union[int, str]):
+    """the read_only openpyxl worksheet of an xlsx file, the workbook is closed on exit"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+    finally:
+        workbook.close()
+
+
+def excel_rows(path: str, sheet: Union[int, str]) -> Iterator[Tuple[Any, ...]]:
+    """the values of the rows of an xlsx sheet, streamed by openpyxl (read_only)"""
+    with open_worksheet(path, sheet) as worksheet:
+        yield from worksheet.iter_rows(values_only=True)
+
+
+def sheet_width(worksheet) -> int:
+    """the columns of a read_only worksheet, as many as the widest row when the file doesn't store its dimension"""
+    if worksheet.max_column is not None:
+        return worksheet.max_column
+    return max((len(row) for row in worksheet.iter_rows(values_only=True)), default=0)
+
+
+def openfile(path: str, sheet: Union[int, str] = 0) -> "pd.DataFrame":
+    pd = import_pandas()
+    if re.findall(r"\.xlsx$", path):
+        # every cell converted on its own like the streamed ones (read_excel infers the type of the columns)
+        rows = [[excel_value(x) for x in row] for row in excel_rows(path, sheet)]
+        width = max((len(row) for row in rows), default=0)
+        df = pd.DataFrame([row + [np.nan] * (width - len(row)) for row in rows], dtype=object)
+    elif is_excel(path):
+        df = pd.read_excel(path, header=None, sheet_name=sheet)
     else:
         df = pd.read_csv(path, header=None)
     return df
 
 
+class SheetCells:
+    """the requested cells of a sheet, read without loading the rest of it"""
+
+    def __init__(self, values: Dict[Tuple[int, int], Any]):
+        self.values = values
+
+    def cell(self, row: int, col: int):
+        """the value of the cell at the 0-based (row, col), IndexError if it wasn't read"""
+        if (row, col) not in self.values:
+            raise IndexError(f"cell ({row + 1}, {col + 1}) is out of the sheet")
+        return self.values[(row, col)]
+
+
+def excel_value(value: Any) -> Any:
+    """the value of an excel cell as it is stored: nan for empty cells and integral floats as int
+
+    applied to every excel cell whatever the path (cached, streamed or read whole), a float column
+    with gaps can't turn 1 into 1.0
+    """
+    if value is None or value == "":
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def read_cells(path: str, sheet: Union[int, str], rows: List[int], cols: List[int]) -> SheetCells:
+    """read only the requested cells (0-based rows and columns)
+
+    xlsx files are streamed by openpyxl (read_only) up to the last requested row and only the
+    columns between the first and the last requested ones are decoded. csv files are parsed with
+    usecols only: the type of a column is inferred from all of its rows as without usecols (nrows
+    would print 1 instead of 1.0 when the gaps come after the last requested row), xls files are
+    read whole. The cells out of the sheet raise IndexError like the cached ones
+    """
+    wanted_rows, wanted_cols = set(rows), sorted(set(cols))
+    values = {}
+    if re.findall(r"\.xlsx$", path):
+        with open_worksheet(path, sheet) as worksheet:
+            # the columns out of the sheet are not read
+            width = sheet_width(worksheet)
+            wanted_cols = [x for x in wanted_cols if x < width]
+            if not wanted_cols:
+                return SheetCells(values)
+            first_col = wanted_cols[0]
+            for ri, row in enumerate(worksheet.iter_rows(min_row=1, max_row=max(rows) + 1, min_col=first_col + 1,
+                                                         max_col=wanted_cols[-1] + 1, values_only=True)):
+                if ri in wanted_rows:
+                    for cj in wanted_cols:
+                        values[(ri, cj)] = excel_value(row[cj - first_col]) if cj - first_col < len(row) else np.nan
+        return SheetCells(values)
+
+    pd = import_pandas()
+    if is_excel(path):
+        df = pd.read_excel(path, header=None, sheet_name=sheet)
+    else:
+        # the columns out of the file would make usecols raise ValueError, the first line gives the width
+        width = len(pd.read_csv(path, header=None, nrows=1).columns)
+        df = pd.read_csv(path, header=None, usecols=[x for x in wanted_cols if x < width])
+    for ri in wanted_rows:
+        if ri < len(df):
+            for cj in wanted_cols:
+                if cj in df.columns:
+                    values[(ri, cj)] = df.at[ri, cj]
+    return SheetCells(values)
+
+
+def open_cached(path: str, sheet: Union[int, str], cache: SheetCache) -> Union[CachedSheet, "pd.DataFrame"]:
+    """the sheet from the cache, parsed and cached on a miss (the dataframe if it can't be cached)"""
+    try:
+        cached = cache.get(path, sheet)
+    except ImportError:
+        # without pyarrow there is no cache
+        return openfile(path, sheet)
+    if cached is not None:
+        return cached
+    df = openfile(path, sheet)
+    try:
+        return cache.put(path, sheet, [[excel_value(x) for x in df.iloc[:, k].tolist()] for k in range(df.shape[1])])
+    except OSError as e:
+        print(f"The sheet can't be cached: {e}", file=sys.stderr)
+        return df
+
+
+def cell(sheet: Union[CachedSheet, SheetCells, "pd.DataFrame"], row: int, col: int):
+    if isinstance(sheet, (CachedSheet, SheetCells)):
+        return sheet.cell(row, col)
+    return sheet.iloc[row, col]
+
+
 def col_id_to_num(col: str) -> int:
     assert all(re.findall(r"[A-Z]+", ci) for ci in col)
 
@@ -60,7 +209,15 @@ def main():
     columns = [c.strip() for c in args["--cols"].split(",")]
     cols = [col_id_to_num(c) if col_type == "REF" else c for c in columns]
 
-    df = openfile(args["<PATH>"])
+    path = args["<PATH>"]
+    sheet = int(args["--sheet"]) if args["--sheet"].isdigit() else args["--sheet"]
+    if is_excel(path) and not args["--no-cache"]:
+        df = open_cached(path, sheet, SheetCache(max_bytes=parse_size(args["--cache-size"])))
+    elif col_type == "REF" and min(rows) >= 0:
+        # only the requested cells
+        df = read_cells(path, sheet, rows, cols)
+    else:
+        df = openfile(path, sheet)
 
     i = 0
     for ri in rows:
@@ -68,7 +225,10 @@ def main():
             print(row_sep, end="")
         j = 0
         for cj in cols:
-            x_rc = df.iloc[ri, cj]
+            x_rc = cell(df, ri, cj)
+            if is_excel(path):
+                # the same value whether the sheet was cached, streamed or read whole
+                x_rc = excel_value(x_rc)
             try:
                 if np.isnan(x_rc):
                     continue